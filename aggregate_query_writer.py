@@ -0,0 +1,242 @@
+import argparse
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from page_performance_calculator import load_credentials, report_countries
+
+# Prefix stripped from page_location to get the cleaned URL
+url_prefix = "https://headstart.gov"
+
+# Timings above this many milliseconds are clamped like the calculator does
+max_timing_ms = 90000
+
+# Row source, URL cleaning and date literal of each SQL dialect
+# bigquery reads the GA4 event export directly, reading event_params once per row
+# sqlite reads a local page_performance_results table such as one loaded from sample Parquet
+query_dialects = {
+    "bigquery": {
+        "events": """SELECT
+    CAST(event_date AS INT64) AS event_date,
+    params.page_url,
+    params.page_load_time_ms,
+    params.server_response_time_ms
+  FROM
+    `hsicc-eblasts-analytics.analytics_249990458.events_*`,
+    UNNEST([(
+      SELECT AS STRUCT
+        MAX(IF(key = "page_location", value.string_value, NULL)) AS page_url,
+        MAX(IF(key = "timing_page_load_time", value.int_value, NULL)) AS page_load_time_ms,
+        MAX(IF(key = "timing_server_response_time", value.int_value, NULL)) AS server_response_time_ms
+      FROM
+        UNNEST(event_params))]) AS params
+  WHERE
+    event_name = "performance_timing"
+    AND geo.country IN ({countries})
+    AND ({date_filter})""",
+        "date_column": "_TABLE_SUFFIX",
+        "date_literal": '"{}"',
+        "clean_url": "SPLIT(REPLACE(page_url, {prefix}, ''), '?')[SAFE_OFFSET(0)]",
+        "least": "LEAST",
+    },
+    "sqlite": {
+        "events": """SELECT
+    event_date,
+    page_url,
+    page_load_time_ms,
+    server_response_time_ms
+  FROM
+    page_performance_results
+  WHERE
+    {date_filter}""",
+        "date_column": "event_date",
+        "date_literal": "{}",
+        "clean_url": "CASE WHEN instr(REPLACE(page_url, {prefix}, ''), '?') > 0 "
+        "THEN substr(REPLACE(page_url, {prefix}, ''), 1, instr(REPLACE(page_url, {prefix}, ''), '?') - 1) "
+        "ELSE REPLACE(page_url, {prefix}, '') END",
+        "least": "MIN",
+    },
+}
+
+aggregate_sql = """WITH events AS (
+  {events}
+)
+SELECT
+  event_date,
+  {clean_url} AS page_url_cleaned,
+  COUNT(*) AS pv,
+  SUM({least}(page_load_time_ms, {max_timing_ms})) / 1000.0 AS plt_sum,
+  COUNT(page_load_time_ms) AS plt_count,
+  SUM({least}(server_response_time_ms, {max_timing_ms})) / 1000.0 AS srt_sum,
+  COUNT(server_response_time_ms) AS srt_count
+FROM
+  events
+WHERE
+  page_url IS NOT NULL
+GROUP BY
+  event_date,
+  page_url_cleaned
+ORDER BY
+  event_date,
+  page_url_cleaned"""
+
+
+"""
+Helper function for the first and last day of a report window as yyyymmdd strings, inclusive of both
+
+@param start_date: yyyymmdd string of the first day of the window
+@param window: number of days after the first day that the window spans
+"""
+def window_bounds(start_date, window):
+    start_day = datetime.strptime(start_date, "%Y%m%d")
+    end_day = start_day + timedelta(days=window)
+    return start_day.strftime("%Y%m%d"), end_day.strftime("%Y%m%d")
+
+
+"""
+Function for the SQL that pre-aggregates the report windows by event_date and cleaned URL with pageview counts, timing sums in seconds
+and the counts of pageviews each timing sum covers
+
+@param windows: list of (first, last) yyyymmdd strings of the report windows
+@param dialect: name of the SQL dialect in query_dialects
+"""
+def build_aggregate_query(windows, dialect):
+    query_dialect = query_dialects[dialect]
+    date_filter = " OR ".join(
+        "{column} BETWEEN {start} AND {end}".format(
+            column=query_dialect["date_column"],
+            start=query_dialect["date_literal"].format(start_date),
+            end=query_dialect["date_literal"].format(end_date),
+        )
+        for start_date, end_date in windows
+    )
+    events = query_dialect["events"].format(
+        countries=", ".join('"{}"'.format(country) for country in report_countries),
+        date_filter=date_filter,
+    )
+    clean_url = query_dialect["clean_url"].format(prefix="'{}'".format(url_prefix))
+    return aggregate_sql.format(
+        events=events,
+        clean_url=clean_url,
+        least=query_dialect["least"],
+        max_timing_ms=max_timing_ms,
+    )
+
+
+"""
+Function for running the sqlite query over a sample Parquet file of the page_performance_results table in an in-memory database
+
+@param query: SQL built for the sqlite dialect
+@param sample_file: path of the sample Parquet file
+"""
+def run_local_query(query, sample_file):
+    sample = pd.read_parquet(
+        sample_file,
+        columns=["event_date", "page_url", "page_load_time_ms", "server_response_time_ms"],
+    )
+    with sqlite3.connect(":memory:") as connection:
+        sample.to_sql("page_performance_results", connection, index=False)
+        return pd.read_sql_query(query, connection)
+
+
+"""
+Function for running the bigquery query in the warehouse so only the aggregated rows are downloaded
+
+@param query: SQL built for the bigquery dialect
+"""
+def run_bigquery_query(query):
+    from google.cloud import bigquery
+
+    credentials = load_credentials()
+    bq_client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+    return bq_client.query(query).to_dataframe()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Writes the SQL that pre-aggregates the page performance events of the previous and current timeframes by day and cleaned URL"
+    )
+    parser.add_argument(
+        "-p",
+        "--previous_start_date",
+        metavar="previousdate",
+        type=str,
+        required=True,
+        help="String representation for the start date of the previous timeframe as (yyyymmdd) format",
+    )
+    parser.add_argument(
+        "-c",
+        "--current_start_date",
+        metavar="currentdate",
+        type=str,
+        required=True,
+        help="String representation for the start date of the current timeframe as (yyyymmdd) format",
+    )
+    parser.add_argument(
+        "-tf",
+        "--time_frame",
+        metavar="timeframe",
+        type=int,
+        default=13,
+        help="Optionally specify the window of time for each dataset. Default is two weeks (14 days inclusive of start date)",
+    )
+    parser.add_argument(
+        "-d",
+        "--dialect",
+        metavar="dialect",
+        type=str,
+        choices=list(query_dialects),
+        default="bigquery",
+        help="SQL dialect of the query, bigquery for the GA4 export or sqlite for a local page_performance_results table. Default is bigquery",
+    )
+    parser.add_argument(
+        "-i",
+        "--sample_file",
+        metavar="samplefile",
+        type=str,
+        help="Run the sqlite query over a sample Parquet file of the page_performance_results table",
+    )
+    parser.add_argument(
+        "-r",
+        "--run",
+        action="store_true",
+        help="Run the bigquery query in the warehouse",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_file",
+        metavar="outputfile",
+        type=str,
+        help="Write the aggregated rows of a run query to a CSV file instead of printing them",
+    )
+    args = parser.parse_args()
+
+    if args.sample_file is not None and args.dialect != "sqlite":
+        parser.error("--sample_file needs the sqlite dialect")
+    if args.run and args.dialect != "bigquery":
+        parser.error("--run needs the bigquery dialect")
+
+    windows = [
+        window_bounds(args.previous_start_date, args.time_frame),
+        window_bounds(args.current_start_date, args.time_frame),
+    ]
+    query = build_aggregate_query(windows, args.dialect)
+
+    if args.sample_file is not None:
+        aggregated = run_local_query(query, args.sample_file)
+    elif args.run:
+        aggregated = run_bigquery_query(query)
+    else:
+        print(query)
+        return
+
+    if args.output_file is not None:
+        aggregated.to_csv(args.output_file, index=False)
+        print("{} aggregated rows written to {}".format(len(aggregated), args.output_file))
+    else:
+        print(aggregated)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""
+@python_version 3.11.1
+@program_description This program generates synthetic performance_timing datasets and benchmarks each stage of the page performance calculator on them, saving the timings and memory use of every run so runs can be compared for regressions.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+import page_performance_calculator as ppc
+
+# The max RSS of the process is only available on Unix, Windows runs record the traced stage memory alone
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Named dataset sizes of the generator
+dataset_sizes = {
+    "1m": 1000000,
+    "10m": 10000000,
+    "100m": 100000000,
+}
+
+# Rows generated and written at a time
+generator_chunk_size = 1000000
+
+# Days covered by the synthetic events, spanning the timeframes of the sample command line
+synthetic_first_day = "20230301"
+synthetic_last_day = "20230420"
+
+# Top level page paths the synthetic URLs are spread over
+synthetic_page_paths = [
+    "",
+    "/about-us",
+    "/browse",
+    "/search",
+    "/teaching-practices",
+    "/family-support-well-being",
+    "/policy",
+    "/professional-development",
+    "/video",
+    "/programs",
+]
+
+# Number of distinct values of each synthetic dimension column
+synthetic_dimension_values = {
+    "country": 9,
+    "region": 60,
+    "city": 2000,
+    "metro": 200,
+    "category": 3,
+    "mobile_brand_name": 40,
+    "mobile_model_name": 400,
+    "os_system": 6,
+    "os_system_version": 80,
+    "language": 30,
+    "web_info_browser": 8,
+    "web_info_browser_version": 150,
+}
+
+# Relative slowdown of a stage over the compared run that is reported as a regression
+default_regression_threshold = 0.1
+
+
+"""
+Helper function for the number of rows of a named dataset size or a plain row count
+
+@param size: name in dataset_sizes or a number of rows
+"""
+def dataset_rows(size):
+    if size.lower() in dataset_sizes:
+        return dataset_sizes[size.lower()]
+    return int(size)
+
+
+"""
+Function for generating one chunk of synthetic performance_timing events with the 17 source columns
+URL popularity follows a Zipf-like curve, timings are long-tailed and a few go past the 90000 ms clamp
+
+@param rng: numpy random generator
+@param rows: number of events in the chunk
+@param page_urls: array of the synthetic page URLs, most popular first
+@param url_weights: probability of each page URL
+@param days: DatetimeIndex of the days the events fall on
+"""
+def generate_chunk(rng, rows, page_urls, url_weights, days):
+    chunk = {
+        column: np.array(
+            ["{}_{}".format(column, value) for value in range(value_count)], dtype=object
+        )[rng.zipf(1.5, rows) % value_count]
+        for column, value_count in synthetic_dimension_values.items()
+    }
+
+    day_index = rng.integers(0, len(days), rows)
+    chunk["event_date"] = days.strftime("%Y%m%d").astype("int64").to_numpy()[day_index]
+    chunk["event_timestamp"] = days.asi8[day_index] // 1000 + rng.integers(
+        0, 86400000000, rows
+    )
+
+    page_url = page_urls[rng.choice(len(page_urls), rows, p=url_weights)]
+    # About a fifth of the page views carry a query string that the cleanup strips
+    has_query = rng.random(rows) < 0.2
+    page_url[has_query] = page_url[has_query] + "?utm_source=synthetic"
+    chunk["page_url"] = page_url
+
+    # Log-normal timings have the long right tail of real page loads
+    chunk["page_load_time_ms"] = rng.lognormal(7.6, 0.9, rows).astype("int64")
+    chunk["server_response_time_ms"] = rng.lognormal(5.8, 1.3, rows).astype("int64")
+    return pd.DataFrame(chunk, columns=ppc.source_columns)
+
+
+"""
+Function for writing a synthetic source file and a matching active URLs file
+
+@param output_dir: directory the synthetic_source.csv and synthetic_active_urls.csv files are written to
+@param rows: number of events to generate
+@param url_count: number of distinct page URLs
+@param seed: seed of the random generator
+"""
+def generate_dataset(output_dir, rows, url_count, seed):
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    url_paths = np.array(
+        [
+            "{}/page-{}".format(synthetic_page_paths[url_index % len(synthetic_page_paths)], url_index)
+            for url_index in range(url_count)
+        ],
+        dtype=object,
+    )
+    page_urls = "https://headstart.gov" + url_paths
+    url_weights = 1 / np.arange(1, url_count + 1) ** 1.1
+    url_weights /= url_weights.sum()
+    days = pd.date_range(synthetic_first_day, synthetic_last_day)
+
+    # Every other URL is active, the rest are dropped by the calculator like retired pages
+    active_urls_path = os.path.join(output_dir, "synthetic_active_urls.csv")
+    pd.DataFrame({"URLs": url_paths[::2]}).to_csv(active_urls_path, index=False)
+
+    source_path = os.path.join(output_dir, "synthetic_source.csv")
+    print("Generating {:,} synthetic events".format(rows))
+    csv_writer = None
+    try:
+        for chunk_start in range(0, rows, generator_chunk_size):
+            chunk_rows = min(generator_chunk_size, rows - chunk_start)
+            chunk = pa.Table.from_pandas(
+                generate_chunk(rng, chunk_rows, page_urls, url_weights, days),
+                preserve_index=False,
+            )
+            # The Arrow CSV writer is several times faster than DataFrame.to_csv at these sizes
+            if csv_writer is None:
+                csv_writer = pa_csv.CSVWriter(source_path, chunk.schema)
+            csv_writer.write_table(chunk)
+            print("{:,} events written".format(chunk_start + chunk_rows))
+    finally:
+        if csv_writer is not None:
+            csv_writer.close()
+
+    return source_path, active_urls_path
+
+
+"""
+Function for running the calculator over a source file the way main() does, loading the active URLs,
+calculating the results with calculate_report_results and writing the workbook
+
+@param source_path: path of the source CSV file
+@param active_urls_path: path of the active URLs CSV file
+@param previous_start_date: yyyymmdd start date of the previous timeframe
+@param current_start_date: yyyymmdd start date of the current timeframe
+@param time_frame: window of time of each timeframe
+@param output_file: path of the results workbook written by the excel_write stage
+@param excel_backend: workbook backend of the excel_write stage, styleframe or streaming
+@param workers: number of threads the results sheets are built and styled on
+@param trace_memory: whether the peak memory of each stage is traced with tracemalloc
+"""
+def run_stages(
+    source_path,
+    active_urls_path,
+    previous_start_date,
+    current_start_date,
+    time_frame,
+    output_file,
+    excel_backend,
+    workers,
+    trace_memory,
+):
+    time_frames = {
+        "previous": ppc.time_frame_bounds(previous_start_date, time_frame),
+        "current": ppc.time_frame_bounds(current_start_date, time_frame),
+    }
+    # The arguments main() parses, with every cache and store left out so each run does the full work
+    report_args = argparse.Namespace(
+        input_file=source_path,
+        source_reader="csv",
+        parquet_cache=None,
+        arrow_store=None,
+        refresh_cache=False,
+        rollup_store=None,
+        quantile_sketch=None,
+        external_metric="plt",
+        bin_edges=ppc.external_bin_edges,
+        workers=workers,
+    )
+
+    # The calculator's own stage instrumentation records every stage, the same way --stage_report does
+    ppc.stage_records.clear()
+    ppc.trace_stage_memory = trace_memory
+    if trace_memory:
+        tracemalloc.start()
+
+    # Builders report their progress, which would drown out the benchmark table
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ppc.instrument_stage("load_active_urls") as stage:
+            active_urls = pd.read_csv(active_urls_path, encoding="latin-1")
+            stage["rows_out"] = len(active_urls)
+        results, raw_results = ppc.calculate_report_results(report_args, time_frames, active_urls)
+        if excel_backend == "streaming":
+            ppc.write_streaming_workbook(results, output_file)
+        else:
+            ppc.write_styled_workbook(results, output_file, workers)
+
+    if trace_memory:
+        tracemalloc.stop()
+        ppc.trace_stage_memory = False
+
+    stages = list(ppc.stage_records)
+    for stage in stages:
+        print("{:<32} {:>10.3f} s".format(stage["name"], stage["wall_seconds"]))
+    return sum(len(raw_results[time_frame]) for time_frame in time_frames), stages
+
+
+"""
+Function for printing how much slower or faster each stage ran than in a saved benchmark run
+
+@param stages: stage measurements of this run
+@param baseline_file: path of the saved benchmark JSON to compare against
+@param regression_threshold: relative slowdown of a stage that is reported as a regression
+"""
+def compare_with_baseline(stages, baseline_file, regression_threshold):
+    with open(baseline_file) as baseline:
+        baseline_stages = {stage["name"]: stage for stage in json.load(baseline)["stages"]}
+
+    regressions = []
+    print("\nCompared with {}:".format(baseline_file))
+    for stage in stages:
+        baseline_stage = baseline_stages.get(stage["name"])
+        if baseline_stage is None or baseline_stage["wall_seconds"] == 0:
+            continue
+        change = stage["wall_seconds"] / baseline_stage["wall_seconds"] - 1
+        flag = ""
+        if change > regression_threshold:
+            flag = "  REGRESSION"
+            regressions.append(stage["name"])
+        print("{:<32} {:>+9.1%}{}".format(stage["name"], change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates synthetic performance_timing datasets and benchmarks each stage of the page performance calculator"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="Generate a synthetic source file and active URLs file"
+    )
+    generate_parser.add_argument(
+        "-s",
+        "--size",
+        metavar="size",
+        type=str,
+        default="1m",
+        help="Number of events as 1m, 10m, 100m or a row count. Default is 1m",
+    )
+    generate_parser.add_argument(
+        "-u",
+        "--urls",
+        metavar="urls",
+        type=int,
+        default=5000,
+        help="Number of distinct page URLs. Default is 5000",
+    )
+    generate_parser.add_argument(
+        "-sd",
+        "--seed",
+        metavar="seed",
+        type=int,
+        default=0,
+        help="Seed of the random generator. Default is 0",
+    )
+    generate_parser.add_argument(
+        "-d",
+        "--output_dir",
+        metavar="outputdir",
+        type=str,
+        default="./benchmark_data",
+        help="Directory the synthetic files are written to. Default is ./benchmark_data",
+    )
+
+    run_parser = subparsers.add_parser(
+        "run", help="Time and memory profile each stage of the calculator"
+    )
+    run_parser.add_argument(
+        "-i",
+        "--input_file",
+        metavar="inputfile",
+        type=str,
+        default="./benchmark_data/synthetic_source.csv",
+        help="Source file to benchmark on. Default is the generated synthetic source file",
+    )
+    run_parser.add_argument(
+        "-a",
+        "--active_urls_file",
+        metavar="activeurlfile",
+        type=str,
+        default="./benchmark_data/synthetic_active_urls.csv",
+        help="Active URLs file to benchmark on. Default is the generated synthetic active URLs file",
+    )
+    run_parser.add_argument(
+        "-p",
+        "--previous_start_date",
+        metavar="previousdate",
+        type=str,
+        default="20230309",
+        help="Start date of the previous timeframe as (yyyymmdd) format. Default is 20230309",
+    )
+    run_parser.add_argument(
+        "-c",
+        "--current_start_date",
+        metavar="currentdate",
+        type=str,
+        default="20230330",
+        help="Start date of the current timeframe as (yyyymmdd) format. Default is 20230330",
+    )
+    run_parser.add_argument(
+        "-tf",
+        "--time_frame",
+        metavar="timeframe",
+        type=int,
+        default=13,
+        help="Window of time for each dataset. Default is two weeks (14 days inclusive of start date)",
+    )
+    run_parser.add_argument(
+        "-eb",
+        "--excel_backend",
+        metavar="backend",
+        type=str,
+        choices=["styleframe", "streaming"],
+        default="styleframe",
+        help="Workbook backend of the excel_write stage. Default is styleframe",
+    )
+    run_parser.add_argument(
+        "-w",
+        "--workers",
+        metavar="workers",
+        type=int,
+        default=4,
+        help="Number of threads the results sheets are built and styled on. Default is 4, like the calculator",
+    )
+    run_parser.add_argument(
+        "-nm",
+        "--no_memory",
+        action="store_true",
+        help="Skip tracing the peak memory of each stage, which slows the stages down",
+    )
+    run_parser.add_argument(
+        "-r",
+        "--results_dir",
+        metavar="resultsdir",
+        type=str,
+        default="./benchmark_results",
+        help="Directory the benchmark JSON of the run is saved to. Default is ./benchmark_results",
+    )
+    run_parser.add_argument(
+        "-cmp",
+        "--compare",
+        metavar="baselinefile",
+        type=str,
+        help="Saved benchmark JSON to compare the stage timings against",
+    )
+    run_parser.add_argument(
+        "-rt",
+        "--regression_threshold",
+        metavar="threshold",
+        type=float,
+        default=default_regression_threshold,
+        help="Relative slowdown of a stage that is reported as a regression. Default is 0.1",
+    )
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        source_path, active_urls_path = generate_dataset(
+            args.output_dir, dataset_rows(args.size), args.urls, args.seed
+        )
+        print("Synthetic files written to {} and {}".format(source_path, active_urls_path))
+        return
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    run_time = datetime.datetime.now()
+    print("Benchmarking {}\n".format(args.input_file))
+    run_start_time = time.perf_counter()
+    rows, stages = run_stages(
+        args.input_file,
+        args.active_urls_file,
+        args.previous_start_date,
+        args.current_start_date,
+        args.time_frame,
+        os.path.join(args.results_dir, "benchmark_results.xlsx"),
+        args.excel_backend,
+        args.workers,
+        not args.no_memory,
+    )
+    # Stages nest and overlap, so the total is the wall time of the whole run rather than a sum of stages
+    total_seconds = time.perf_counter() - run_start_time
+    print("{:<32} {:>10.3f} s".format("total", total_seconds))
+
+    max_rss_mb = None
+    if resource is not None:
+        max_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    benchmark = {
+        "created": run_time.isoformat(timespec="seconds"),
+        "input_file": args.input_file,
+        "time_frame_rows": rows,
+        "excel_backend": args.excel_backend,
+        "python_version": platform.python_version(),
+        "pandas_version": pd.__version__,
+        "numpy_version": np.__version__,
+        "total_seconds": round(total_seconds, 4),
+        "max_rss_mb": max_rss_mb,
+        "stages": stages,
+    }
+    benchmark_file = os.path.join(
+        args.results_dir, "benchmark_{}.json".format(run_time.strftime("%Y%m%d_%H%M%S"))
+    )
+    with open(benchmark_file, "w") as benchmark_output:
+        json.dump(benchmark, benchmark_output, indent=2)
+    print("\nBenchmark saved to {}".format(benchmark_file))
+
+    if args.compare is not None:
+        regressions = compare_with_baseline(stages, args.compare, args.regression_threshold)
+        if regressions:
+            raise SystemExit(
+                "Stages slower than the baseline: {}".format(", ".join(regressions))
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
-from google.cloud import bigquery
-from google.oauth2 import service_account
+import argparse
+import os
+import re
+import shutil
 
-credentials = service_account.Credentials.from_service_account_file(
-    ".\\hsicc-eblasts-analytics-1d54ac154638.json", scopes=["https://www.googleapis.com/auth/cloud-platform"],
-)
+import pandas as pd
 
-bq_client = bigquery.Client(credentials=credentials, project=credentials.project_id,)
+from page_performance_calculator import bq_partition_column, bq_table, load_credentials, report_countries
 
-table_string = "hsicc-eblasts-analytics.eclkc_advanced_analytics.page_performance_results"
+table_string = bq_table
+events_dataset = "hsicc-eblasts-analytics.analytics_249990458"
 
-job_config = bigquery.QueryJobConfig(destination=table_string)
-job_config.write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
+# First daily events shard loaded into an empty table
+first_shard = "20230201"
 
+# GA4 keeps updating daily events shards for up to three days, so the latest loaded days are reloaded
+default_lookback_days = 3
+
+# Daily shards of the GA4 export, the intraday tables are left out
+shard_pattern = re.compile(r"^events_(\d{8})$")
 
 modify_table_sql = """ SELECT
   geo.country,
@@ -27,6 +33,7 @@ modify_table_sql = """ SELECT
   device.web_info.browser as web_info_browser,
   device.web_info.browser_version as web_info_browser_version,
   event_date,
+  PARSE_DATE("%Y%m%d", event_date) AS {partition_column},
   event_timestamp,
   (
   SELECT
@@ -50,13 +57,212 @@ modify_table_sql = """ SELECT
   WHERE
     KEY = "timing_server_response_time") AS server_response_time_ms
 FROM
-  `hsicc-eblasts-analytics.analytics_249990458.events_*`
+  `{events_dataset}.events_{shard}`
 WHERE
   event_name = "performance_timing"
-  AND (geo.country = "United States" OR geo.country = "American Samoa" OR geo.country = "Micronesia" OR geo.country = "Guam" OR geo.country = "Marshall Islands"  OR geo.country = "Northern Mariana Islands" OR geo.country = "Palau" OR geo.country = "Puerto Rico" OR geo.country = "U.S. Virgin Islands")
-  AND (_TABLE_SUFFIX BETWEEN "20230201" and "20230626")"""
+  AND geo.country IN ({countries})"""
+
+
+"""
+Warehouse backed by BigQuery, loading each daily events shard into its own day partition of the table
+"""
+class BigQueryWarehouse:
+    def __init__(self):
+        from google.api_core.exceptions import NotFound
+        from google.cloud import bigquery
+
+        credentials = load_credentials()
+        self.bigquery = bigquery
+        self.not_found = NotFound
+        self.bq_client = bigquery.Client(credentials=credentials, project=credentials.project_id,)
+
+    """
+    Function for the daily shards of the events export
+    """
+    def source_shards(self):
+        return sorted(
+            match.group(1)
+            for match in (
+                shard_pattern.match(table.table_id)
+                for table in self.bq_client.list_tables(events_dataset)
+            )
+            if match
+        )
+
+    """
+    Function for the day partitions already loaded into the table, read from the table metadata without scanning it
+    """
+    def loaded_shards(self):
+        try:
+            table = self.bq_client.get_table(table_string)
+        except self.not_found:
+            return []
+        if table.time_partitioning is None or table.time_partitioning.field != bq_partition_column:
+            raise SystemExit(
+                "The table {} is not partitioned on its {} column, drop it once so it is rebuilt shard by shard".format(
+                    table_string, bq_partition_column
+                )
+            )
+
+        partitions = self.bq_client.list_partitions(table_string)
+        return sorted(partition for partition in partitions if partition.isdigit())
+
+    """
+    Function for replacing the day partition of a shard with the shard's performance_timing events
+
+    @param shard: yyyymmdd suffix of the events shard
+    """
+    def load_shard(self, shard):
+        job_config = self.bigquery.QueryJobConfig(
+            destination="{}${}".format(table_string, shard),
+            # Partitioned on the event day rather than the load time, so readers filtering on it prune partitions
+            time_partitioning=self.bigquery.TimePartitioning(
+                type_=self.bigquery.TimePartitioningType.DAY, field=bq_partition_column
+            ),
+        )
+        # Truncating only the shard's partition makes reloading a day idempotent
+        job_config.write_disposition = self.bigquery.WriteDisposition.WRITE_TRUNCATE
+
+        query_job = self.bq_client.query(shard_query(shard), job_config=job_config)  # Make an API request.
+        query_job.result()  # Wait for the job to complete.
+
+
+"""
+Local stand-in for the warehouse, with Parquet files of flattened events shards named events_yyyymmdd.parquet
+and the table as a directory of event_date=yyyymmdd partitions
+"""
+class LocalWarehouse:
+    def __init__(self, source_dir, table_dir):
+        self.source_dir = source_dir
+        self.table_dir = table_dir
+
+    """
+    Function for the daily shards in the source directory
+    """
+    def source_shards(self):
+        return sorted(
+            match.group(1)
+            for match in (
+                shard_pattern.match(os.path.splitext(file_name)[0])
+                for file_name in os.listdir(self.source_dir)
+                if file_name.endswith(".parquet")
+            )
+            if match
+        )
+
+    """
+    Function for the day partitions already in the table directory
+    """
+    def loaded_shards(self):
+        if not os.path.isdir(self.table_dir):
+            return []
+        return sorted(
+            partition.split("=")[1]
+            for partition in os.listdir(self.table_dir)
+            if partition.startswith("event_date=")
+        )
+
+    """
+    Function for replacing the day partition of a shard with the shard's events from the report countries
+
+    @param shard: yyyymmdd suffix of the events shard
+    """
+    def load_shard(self, shard):
+        events = pd.read_parquet(
+            os.path.join(self.source_dir, "events_{}.parquet".format(shard))
+        )
+        # The event_date of a row comes from its partition directory, like a hive partitioned dataset
+        events = events[events["country"].isin(report_countries)].drop(
+            columns="event_date", errors="ignore"
+        )
+
+        partition_dir = os.path.join(self.table_dir, "event_date={}".format(shard))
+        if os.path.isdir(partition_dir):
+            shutil.rmtree(partition_dir)
+        os.makedirs(partition_dir)
+        events.to_parquet(os.path.join(partition_dir, "part-0.parquet"), index=False)
+
+
+"""
+Helper function for the SQL that selects the performance_timing events of a single daily shard
+
+@param shard: yyyymmdd suffix of the events shard
+"""
+def shard_query(shard):
+    return modify_table_sql.format(
+        events_dataset=events_dataset,
+        shard=shard,
+        partition_column=bq_partition_column,
+        countries=", ".join('"{}"'.format(country) for country in report_countries),
+    )
+
+
+"""
+Function for the shards to load, every source shard after the high-water mark of the loaded partitions
+along with the latest loaded days, which GA4 may still have updated
+
+@param source_shards: sorted yyyymmdd suffixes of the daily events shards
+@param loaded_shards: sorted yyyymmdd suffixes of the partitions already loaded
+@param lookback_days: number of the latest loaded days that are reloaded
+"""
+def shards_to_load(source_shards, loaded_shards, lookback_days):
+    if not loaded_shards:
+        return [shard for shard in source_shards if shard >= first_shard]
+
+    high_water_mark = pd.to_datetime(loaded_shards[-1], format="%Y%m%d")
+    reload_from = (high_water_mark - pd.DateOffset(days=lookback_days)).strftime("%Y%m%d")
+    return [shard for shard in source_shards if shard > reload_from]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incrementally loads the daily events shards after the latest loaded day into the page_performance_results table"
+    )
+    parser.add_argument(
+        "-lb",
+        "--lookback",
+        metavar="days",
+        type=int,
+        default=default_lookback_days,
+        help="Optionally specify the number of the latest loaded days that are reloaded, as GA4 keeps updating recent shards. Default is 3",
+    )
+    parser.add_argument(
+        "-l",
+        "--local",
+        metavar=("sourcedir", "tabledir"),
+        nargs=2,
+        type=str,
+        help="Load from a directory of events_yyyymmdd.parquet shards into a local partitioned table directory instead of BigQuery",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry_run",
+        action="store_true",
+        help="Only list the shards that would be loaded",
+    )
+    args = parser.parse_args()
+
+    if args.lookback < 0:
+        parser.error("--lookback cannot be negative")
+
+    if args.local is not None:
+        warehouse = LocalWarehouse(*args.local)
+    else:
+        warehouse = BigQueryWarehouse()
+
+    loaded_shards = warehouse.loaded_shards()
+    new_shards = shards_to_load(warehouse.source_shards(), loaded_shards, args.lookback)
+    if loaded_shards:
+        print("Latest loaded shard is {}".format(loaded_shards[-1]))
+    print("{} shards to load".format(len(new_shards)))
+
+    for shard in new_shards:
+        if args.dry_run:
+            print("Would load shard {}".format(shard))
+            continue
+        warehouse.load_shard(shard)
+        print("Shard {} loaded".format(shard))
 
-query_job = bq_client.query(modify_table_sql, job_config=job_config)  # Make an API request.
-query_job.result()  # Wait for the job to complete.
 
-print("Query results loaded to the table {}".format(table_string))
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -6,23 +6,48 @@
 @program_author Matthew Morrow
 @program_description This program generates the various page performance reports based on user dictated start dates, timeframe window, and input file with the raw performance data.
 """
+import time
+
+# Measured before the heavy imports so the startup duration covers them
+startup_start_time = time.perf_counter()
+
+import contextlib
+import cProfile
 import datetime
+import functools
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+import tracemalloc
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 # from decouple import config
 # from boxsdk import OAuth2, Client
 
-from styleframe import StyleFrame, Styler, utils
+# Styling, Arrow and Google Cloud modules are imported by the functions that use them
+# so local runs and --help start without them or the service account file
 
-from google.cloud import bigquery
-from google.oauth2 import service_account
+# Service account file of the GCS and BigQuery reads
+service_account_file = ".\\hsicc-eblasts-analytics-1d54ac154638.json"
 
-credentials = service_account.Credentials.from_service_account_file(
-    ".\\hsicc-eblasts-analytics-1d54ac154638.json",
-    scopes=["https://www.googleapis.com/auth/cloud-platform"],
-)
+# Wall time, CPU time, rows and memory of every instrumented stage of the run, in the order the stages finish
+stage_records = []
+
+# Whether the peak memory of each stage is traced, turned on with --stage_report
+trace_stage_memory = False
+
+# Stages open at the moment by id, each holding the highest traced memory seen since it started
+open_stage_peaks = {}
+open_stage_lock = threading.Lock()
 
 previous_raw_results = pd.DataFrame()
 current_raw_results = pd.DataFrame()
@@ -45,6 +70,248 @@ bucket_location_for_active_urls = (
     "gs://eclkc_advanced_analytics/eclkc_urls_200_status_code.csv"
 )
 
+# BigQuery table the raw results are exported from
+bq_table = "hsicc-eblasts-analytics.eclkc_advanced_analytics.page_performance_results"
+
+# DATE column derived from event_date that the BigQuery table is partitioned on, filtering on it prunes partitions
+bq_partition_column = "event_day"
+
+# Countries of the performance_timing events loaded into the table and included in the reports
+report_countries = [
+    "United States",
+    "American Samoa",
+    "Micronesia",
+    "Guam",
+    "Marshall Islands",
+    "Northern Mariana Islands",
+    "Palau",
+    "Puerto Rico",
+    "U.S. Virgin Islands",
+]
+
+# Columns read from the raw performance dataset, in the order of the page_performance_results table
+source_columns = [
+    "country",
+    "region",
+    "city",
+    "metro",
+    "category",
+    "mobile_brand_name",
+    "mobile_model_name",
+    "os_system",
+    "os_system_version",
+    "language",
+    "web_info_browser",
+    "web_info_browser_version",
+    "event_date",
+    "event_timestamp",
+    "page_url",
+    "page_load_time_ms",
+    "server_response_time_ms",
+]
+
+# Low-cardinality string columns held as dictionary-encoded categoricals
+dimension_columns = [
+    "country",
+    "region",
+    "city",
+    "metro",
+    "category",
+    "mobile_brand_name",
+    "mobile_model_name",
+    "os_system",
+    "os_system_version",
+    "language",
+    "web_info_browser",
+    "web_info_browser_version",
+]
+
+# Columns interned as categoricals when the source dataset is loaded, page_url codes double as URL IDs
+categorical_columns = dimension_columns + ["page_url"]
+
+# Named aggregations of the per URL and per page path groupings
+page_url_aggregations = {
+    "pv": ("page_url_cleaned", "count"),
+    "plt_sum": ("plt_sec", "sum"),
+    "plt_avg": ("plt_sec", "mean"),
+    "srt_sum": ("srt_sec", "sum"),
+    "srt_avg": ("srt_sec", "mean"),
+}
+page_path_aggregations = {
+    "pages": ("page_url_cleaned", "nunique"),
+    "pv": ("page_path_one", "count"),
+    "plt_sum": ("plt_sec", "sum"),
+    "plt_avg": ("plt_sec", "mean"),
+    "srt_sum": ("srt_sec", "sum"),
+    "srt_avg": ("srt_sec", "mean"),
+}
+
+# Days up to the latest source day that may still have been incomplete when rolled up, refreshed once the source changes
+rollup_refresh_days = 3
+
+# Layout version of the rollup store, a store written with another version is rebuilt
+rollup_store_version = 2
+
+# Relative accuracy of the daily quantile sketches when --quantile_sketch is given without a value
+default_sketch_accuracy = 0.01
+
+# Named aggregations that combine daily rollups into the per URL and per page path groupings
+# Averages divide by the plt_count and srt_count of timed pageviews, as the mean of the raw events skips missing timings
+page_url_rollup_aggregations = {
+    "pv": ("pv", "sum"),
+    "plt_sum": ("plt_sum", "sum"),
+    "plt_count": ("plt_count", "sum"),
+    "srt_sum": ("srt_sum", "sum"),
+    "srt_count": ("srt_count", "sum"),
+}
+page_path_rollup_aggregations = {
+    "pages": ("page_url_cleaned", "nunique"),
+    "pv": ("pv", "sum"),
+    "plt_sum": ("plt_sum", "sum"),
+    "plt_count": ("plt_count", "sum"),
+    "srt_sum": ("srt_sum", "sum"),
+    "srt_count": ("srt_count", "sum"),
+}
+
+# Results sheets in workbook order with the title printed once each is written, trend runs only write the trend sheets
+# Column formats are (columns, number format, horizontal alignment), None styles every column
+report_sheets = {
+    "top_level": {
+        "title": "Top Level Summary",
+        "column_formats": [
+            (["Metrics"], "General", "left"),
+            (["Pages"], "General", "right"),
+            (
+                [
+                    "Pageview % Change",
+                    "Page Load Time % Change",
+                    "Server Response Time % Change",
+                ],
+                "0.0%",
+                "right",
+            ),
+            (
+                [
+                    "Page Load Times (sec)",
+                    "Page Load Time Error Bound (sec)",
+                    "Server Response Times (sec)",
+                    "Server Response Time Error Bound (sec)",
+                ],
+                "0.00",
+                "right",
+            ),
+        ],
+    },
+    "external_comparison": {
+        "title": "External Comparison Summary",
+        "column_formats": [
+            (["Metrics"], "General", "left"),
+            (["Percent of Total Page URLs", "Percent of Total Pageviews"], "0.0%", "right"),
+            (["Number of Page URLs", "Number of Pageviews"], "0", "right"),
+        ],
+    },
+    "grouped_by_page_path": {
+        "title": "Grouped by Page Path",
+        "column_formats": [
+            (["page_path_one"], "General", "left"),
+            (["pages", "pv"], "0", "right"),
+            (
+                [
+                    "pv_percent_of_total",
+                    "pv_percent_change",
+                    "plt_percent_change",
+                    "srt_percent_change",
+                ],
+                "0.0%",
+                "right",
+            ),
+            (["plt_avg", "srt_avg"], "0.00", "right"),
+        ],
+    },
+    "grouped_by_page_url": {
+        "title": "Grouped by Page URL",
+        "column_formats": [(None, "General", "right")],
+        "highlight_outliers": True,
+    },
+    "top_pageview_changes": {
+        "title": "Top Pageview Change",
+        "column_formats": [
+            (["page_url_cleaned"], "General", "left"),
+            (["pv_current"], "0", "right"),
+            (["pv_percent_of_total", "pv_percent_change"], "0.0%", "right"),
+        ],
+    },
+    "change_outliers": {
+        "title": "Change Outlier",
+        "column_formats": [
+            (["page_url_cleaned"], "General", "left"),
+            (["pv_current"], "0", "right"),
+            (["plt_avg_current", "srt_avg_current"], "0.00", "right"),
+            (
+                ["pv_percent_of_total", "plt_percent_change", "srt_percent_change"],
+                "0.0%",
+                "right",
+            ),
+            (["outlier_value"], "General", "right"),
+        ],
+    },
+    "current_outliers": {
+        "title": "Current Outlier",
+        "column_formats": [
+            (["page_url_cleaned"], "General", "left"),
+            (["pv_current"], "0", "right"),
+            (["plt_avg_current", "srt_avg_current"], "0.00", "right"),
+            (
+                ["pv_percent_of_total", "plt_percent_change", "srt_percent_change"],
+                "0.0%",
+                "right",
+            ),
+            (["outlier_value"], "General", "right"),
+        ],
+    },
+    "trend_site": {
+        "title": "Site Trend",
+        "column_formats": [
+            (["window_start", "window_end"], "General", "left"),
+            (["pages", "pv"], "0", "right"),
+            (["plt_avg", "srt_avg"], "0.00", "right"),
+            (["pv_percent_change", "plt_percent_change", "srt_percent_change"], "0.0%", "right"),
+        ],
+    },
+    "trend_url": {
+        "title": "URL Trend",
+        "column_formats": [
+            (["window_start", "window_end", "page_url_cleaned"], "General", "left"),
+            (["pv"], "0", "right"),
+            (["plt_avg", "srt_avg"], "0.00", "right"),
+        ],
+    },
+}
+
+# Fill of the rows of URLs that are current outliers
+outlier_bg_color = "F25454"
+
+# Default size cap in megabytes of the result cache, the least recently used entries are evicted past it
+result_cache_size_mb = 1024
+
+# Bytes read at a time when fingerprinting the contents of a local input file
+fingerprint_block_size = 2**20
+
+# Bucket edges in seconds of the external comparison results
+external_bin_edges = [0.8, 1.7, 2.9, 5, 10, 30, 90]
+
+# Number of rows parsed at a time when streaming the raw source file
+source_chunk_size = 500000
+
+# File extensions the raw timeframe datasets can be written to
+raw_dataset_extensions = (".xlsx", ".csv", ".csv.gz", ".parquet")
+
+# Number of rows written at a time when streaming the raw timeframe datasets to CSV or Parquet
+raw_export_chunk_size = 500000
+
+# Rows of an Excel worksheet below the header row
+excel_max_rows = 1048575
+
 """
 Helper function for percent difference and returns N/A if previous value is null
 
@@ -82,6 +349,209 @@ def weighted_avg(values, weights):
     return (values * weights).sum() / weights.sum()
 
 
+"""
+Helper function for the bucket of each value, buckets are (lower, upper] between consecutive edges, below the first edge,
+and at or above the last edge
+
+@param values: array of values to be bucketed
+@param bin_edges: sorted bucket edges
+"""
+def bin_indices(values, bin_edges):
+    buckets = np.searchsorted(bin_edges, values, side="left")
+    buckets[values >= bin_edges[-1]] = len(bin_edges)
+    return buckets
+
+
+"""
+Helper function for assigning values to buckets in a single pass and counting each bucket
+
+@param values: values to be bucketed, missing values are not counted
+@param bin_edges: sorted bucket edges
+@param weights: optional count of each value, such as the counts of a histogram
+"""
+def bin_counts(values, bin_edges, weights=None):
+    values = np.asarray(values, dtype="float64")
+    is_present = ~np.isnan(values)
+    values = values[is_present]
+
+    buckets = bin_indices(values, bin_edges)
+
+    if weights is not None:
+        weights = np.asarray(weights)[is_present]
+    return np.bincount(buckets, weights=weights, minlength=len(bin_edges) + 1)
+
+
+"""
+Helper function for the labels of the buckets made by bin_counts, from the fastest to the slowest
+
+@param bin_edges: sorted bucket edges in seconds
+"""
+def bin_labels(bin_edges):
+    labels = ["<= {:g} secs:".format(bin_edges[0])]
+    labels += [
+        ">{:g} - <={:g} secs:".format(lower_edge, upper_edge)
+        for lower_edge, upper_edge in zip(bin_edges[:-2], bin_edges[1:-1])
+    ]
+    labels.append(">{:g} - <{:g} secs:".format(bin_edges[-2], bin_edges[-1]))
+
+    # Timings are clamped at 90 seconds, so a top edge of 90 only holds clamped timings
+    if bin_edges[-1] == 90:
+        labels.append("90 secs:")
+    else:
+        labels.append(">= {:g} secs:".format(bin_edges[-1]))
+    return labels
+
+
+"""
+Helper function for the sorted histogram of a series, the distinct values and how often each occurs
+
+@param values: series of values to be counted
+"""
+def value_histogram(values):
+    return values.value_counts().sort_index()
+
+
+"""
+Helper function for quantiles of a histogram, matching the linear interpolation of pandas quantile
+An empty histogram gives NaN for every quantile, as pandas quantile does for a series without values
+
+@param histogram: series of counts indexed by sorted value
+@param quantiles: list of the quantiles to be calculated
+"""
+def histogram_quantiles(histogram, quantiles):
+    values = histogram.index.to_numpy(dtype="float64")
+    cumulative_counts = histogram.to_numpy().cumsum()
+    if len(cumulative_counts) == 0 or cumulative_counts[-1] == 0:
+        return np.full(len(quantiles), np.nan)
+    last_rank = cumulative_counts[-1] - 1
+
+    positions = last_rank * np.asarray(quantiles, dtype="float64")
+    lower_ranks = np.floor(positions)
+    fractions = positions - lower_ranks
+    lower_values = values[np.searchsorted(cumulative_counts, lower_ranks, side="right")]
+    upper_values = values[
+        np.searchsorted(
+            cumulative_counts, np.minimum(lower_ranks + 1, last_rank), side="right"
+        )
+    ]
+
+    differences = upper_values - lower_values
+    return np.where(
+        fractions >= 0.5,
+        upper_values - differences * (1 - fractions),
+        lower_values + differences * fractions,
+    )
+
+
+"""
+Function for summarizing a distribution in one pass over its histogram
+
+@param histogram: series of counts indexed by sorted value
+"""
+def summarize_distribution(histogram):
+    values = histogram.index.to_numpy(dtype="float64")
+    counts = histogram.to_numpy()
+    total = (values * counts).sum()
+    average = total / counts.sum() if counts.sum() > 0 else np.nan
+    min_value, quartile_25, quartile_50, quartile_75, max_value = histogram_quantiles(
+        histogram, [0, 0.25, 0.5, 0.75, 1]
+    )
+
+    return pd.Series(
+        {
+            "Total": total,
+            "Average": average,
+            "Min": min_value,
+            "25th": quartile_25,
+            "50th": quartile_50,
+            "75th": quartile_75,
+            "Max": max_value,
+            "Threshold": quartile_75 + 1.5 * (quartile_75 - quartile_25),
+        }
+    )
+
+
+"""
+Helper function for the page load and server response time histograms of a timeframe
+
+@param raw_results: raw dataframe of the timeframe
+"""
+def build_histograms(raw_results):
+    return {
+        "plt_sec": value_histogram(raw_results["plt_sec"]),
+        "srt_sec": value_histogram(raw_results["srt_sec"]),
+    }
+
+
+"""
+Function for the distribution summary of a timeframe, shared by the top level and outlier results
+
+@param histograms: page load and server response time histograms of the timeframe
+@param grouped_by_url: the timeframe grouped by URL
+"""
+def summarize_time_frame(histograms, grouped_by_url):
+    return pd.DataFrame(
+        {
+            "plt_sec": summarize_distribution(histograms["plt_sec"]),
+            "srt_sec": summarize_distribution(histograms["srt_sec"]),
+            "pv": summarize_distribution(value_histogram(grouped_by_url["pv"])),
+        }
+    )
+
+
+"""
+Helper function for mapping timings onto the buckets of a relative error quantile sketch
+Buckets grow geometrically, so each bucket value is within the relative accuracy of every timing it stands in for and a day
+of timings between 1 ms and the 90 second clamp fills a few hundred buckets however many events it has. Bucket values are
+kept on the same side of every external comparison bin edge as their timings, so sketched timings bucket exactly
+
+@param values: series of non-negative timings in seconds
+@param relative_accuracy: relative error bound of the sketch, such as 0.01 for 1%
+@param bin_edges: sorted external comparison bin edges in seconds
+"""
+def sketch_values(values, relative_accuracy, bin_edges):
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    timings = values.to_numpy(dtype="float64")
+    positive_timings = np.where(timings > 0, timings, np.nan)
+    bucket_values = 2 * np.power(gamma, np.ceil(np.log(positive_timings) / np.log(gamma))) / (gamma + 1)
+
+    # Each bin is (lower, upper], below the first edge or at and above the last edge, a bucket value past the bin of its
+    # timing is moved back to the nearest value of the bin, which is closer to the timing still
+    bin_edges = np.asarray(bin_edges, dtype="float64")
+    lower_bounds = np.concatenate([[-np.inf], np.nextafter(bin_edges[:-1], np.inf), bin_edges[-1:]])
+    upper_bounds = np.concatenate([bin_edges[:-1], np.nextafter(bin_edges[-1:], -np.inf), [np.inf]])
+    buckets = bin_indices(np.nan_to_num(timings), bin_edges)
+    bucket_values = np.clip(bucket_values, lower_bounds[buckets], upper_bounds[buckets])
+
+    return pd.Series(np.where(timings > 0, bucket_values, timings), index=values.index)
+
+
+"""
+Function for the distribution summary of a timeframe whose timing histograms were merged from daily quantile sketches
+Pageview statistics and timing averages are exact, every other timing statistic gets the absolute error bound of the sketch
+
+@param histograms: sketched page load and server response time histograms of the timeframe
+@param grouped_by_url: the timeframe grouped by URL
+@param timing_totals: dict of timing metric to the exact (sum, count) of its timings in the timeframe
+@param relative_accuracy: relative error bound the sketches were built with
+"""
+def summarize_sketched_time_frame(histograms, grouped_by_url, timing_totals, relative_accuracy):
+    time_frame_summary = summarize_time_frame(histograms, grouped_by_url)
+
+    for metric, (timing_sum, timing_count) in timing_totals.items():
+        time_frame_summary.at["Total", metric] = timing_sum
+        time_frame_summary.at["Average", metric] = timing_sum / timing_count if timing_count > 0 else np.nan
+
+        # A bucket value b stands in for timings no further than b * accuracy / (1 - accuracy) away, and interpolating
+        # between two bucket values keeps that bound
+        error_bound = time_frame_summary[metric].abs() * relative_accuracy / (1 - relative_accuracy)
+        error_bound[["Total", "Average"]] = 0
+        error_bound["Threshold"] = 2.5 * error_bound["75th"] + 1.5 * error_bound["25th"]
+        time_frame_summary[metric + "_error"] = error_bound
+
+    return time_frame_summary
+
+
 def main():
     program_start_time = datetime.datetime.now()
 
@@ -104,8 +574,7 @@ def main():
         metavar="previousdate",
         type=str,
         nargs=1,
-        help="String representation for the start date of the previous timeframe as (yyyymmdd) format",
-        required=True,
+        help="String representation for the start date of the previous timeframe as (yyyymmdd) format, required unless --trend is specified",
     )
     parser.add_argument(
         "-c",
@@ -113,8 +582,7 @@ def main():
         metavar="currentdate",
         type=str,
         nargs=1,
-        help="String representation for the start date of the current timeframe as (yyyymmdd) format",
-        required=True,
+        help="String representation for the start date of the current timeframe as (yyyymmdd) format, required unless --trend is specified",
     )
     parser.add_argument(
         "-tf",
@@ -156,532 +624,1729 @@ def main():
         metavar="rawdatasets",
         nargs="?",
         type=str,
-        help="If a path is specified, will write out the two raw timeframe datasets to a seperate file for inspection",
+        help="If a path is specified, will write out the two raw timeframe datasets to a seperate file for inspection. The format follows the extension: .xlsx, .csv, .csv.gz or .parquet",
     )
-    args = parser.parse_args()
-
-    # If the user did not specify
-    if args.active_urls_file is None:
-
-        print("Getting active URLs file from GCS")
-        headstart_active_urls = pd.read_csv(
-            bucket_location_for_active_urls,
-            encoding="latin-1",
-            storage_options={"token": credentials},
-        )
-        print("Active URLs file read from GCS")
-
-    else:
-        print("Reading active URLs file from path")
-        headstart_active_urls = pd.read_csv(args.active_urls_file, encoding="latin-1")
-
-    if args.input_file is None:
-        """print("Getting source file from Box")
-        raw_bq_results_id = config("raw_big_query_results_box_id")
-        raw_results_file_url = client.file(raw_bq_results_id).get_download_url()
-        source_dataset = pd.read_csv(raw_results_file_url, encoding="latin-1",
-            usecols=[
-                "event_date",
-                "page_url",
-                "page_load_time_ms",
-                "server_response_time_ms",
-            ],
-        )
-        print("Source file read from Box")"""
-
-        print("Getting source file from GCS")
-        source_dataset = pd.read_csv(
-            bucket_location_for_raw_data,
-            encoding="latin-1",
-            storage_options={"token": credentials},
-            usecols=[
-                "event_date",
-                "event_timestamp",
-                "country",
-                "region",
-                "city",
-                "metro",
-                "category",
-                "mobile_brand_name",
-                "mobile_model_name",
-                "os_system",
-                "os_system_version",
-                "language",
-                "web_info_browser",
-                "web_info_browser_version",
-                "page_url",
-                "page_load_time_ms",
-                "server_response_time_ms",
-            ],
-        )
-        print("Source file read from GCS")
-    else:
-        print("Reading source file from path")
-        source_dataset = pd.read_csv(
-            args.input_file,
-            encoding="latin-1",
-            usecols=[
-                "event_date",
-                "event_timestamp",
-                "country",
-                "region",
-                "city",
-                "metro",
-                "category",
-                "mobile_brand_name",
-                "mobile_model_name",
-                "os_system",
-                "os_system_version",
-                "language",
-                "web_info_browser",
-                "web_info_browser_version",
-                "page_url",
-                "page_load_time_ms",
-                "server_response_time_ms",
-            ],
-        )
-    source_dataset["event_date"] = pd.to_datetime(
-        source_dataset["event_date"], format="%Y%m%d"
+    parser.add_argument(
+        "-rdc",
+        "--raw_columns",
+        metavar="rawcolumn",
+        nargs="+",
+        type=str,
+        help="Optionally limit the raw timeframe datasets to the specified columns",
     )
-    source_dataset["event_timestamp"] = pd.to_datetime(source_dataset["event_timestamp"], unit="us")
-
-    source_dataset.loc[source_dataset['page_load_time_ms'] > 90000, 'page_load_time_ms'] = 90000
-    source_dataset.loc[source_dataset['server_response_time_ms'] > 90000, 'server_response_time_ms'] = 90000
-
-    print("\nCalculating results:")
-    previous_raw_results = calculate_time_frame(
-        args.previous_start_date[0], args.time_frame, source_dataset, headstart_active_urls
+    parser.add_argument(
+        "-pc",
+        "--parquet_cache",
+        metavar="cachedir",
+        nargs="?",
+        type=str,
+        help="If a directory is specified, read the source dataset from a local Parquet cache partitioned by event_date, building the cache from the source file on first use",
     )
-    previous_grouped_by_url = group_by_page_url(previous_raw_results)
-
-    current_raw_results = calculate_time_frame(
-        args.current_start_date[0], args.time_frame, source_dataset, headstart_active_urls
+    parser.add_argument(
+        "-as",
+        "--arrow_store",
+        metavar="storefile",
+        type=str,
+        help="If a path is specified, read the typed source dataset from a memory-mapped Arrow IPC file shared by every run and process using it, writing the file from the source file on first use",
     )
-    current_grouped_by_url = group_by_page_url(current_raw_results)
-
-    calculated_grouped_by_page_url = merge_groups_by_page_url(
-        previous_grouped_by_url, current_grouped_by_url
+    parser.add_argument(
+        "-rc",
+        "--refresh_cache",
+        action="store_true",
+        help="Rebuild the Parquet cache, Arrow store and rollup store from the source file even if they already exist",
     )
-
-    top_level_summary = create_top_results(
-        previous_raw_results,
-        previous_grouped_by_url,
-        current_raw_results,
-        current_grouped_by_url,
+    parser.add_argument(
+        "-ru",
+        "--rollup_store",
+        metavar="storedir",
+        nargs="?",
+        type=str,
+        help="If a directory is specified, build the report from daily per URL rollups kept in the directory, adding any missing days from the source file",
     )
-
-    styled_top_level_summary = StyleFrame(top_level_summary)
-    style_header_row(styled_top_level_summary)
-    styled_top_level_summary.apply_column_style(
-        cols_to_style=["Metrics"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general,
-            horizontal_alignment=utils.horizontal_alignments.left,
-        ),
+    parser.add_argument(
+        "-qs",
+        "--quantile_sketch",
+        metavar="accuracy",
+        nargs="?",
+        type=float,
+        const=default_sketch_accuracy,
+        help="If specified with --rollup_store, keep daily quantile sketches with the given relative accuracy (default is 0.01) instead of exact timing histograms, so any window is summarized from a bounded number of buckets per day, and report each statistic's error bound",
     )
-    styled_top_level_summary.apply_column_style(
-        cols_to_style=["Pages"],
-        styler_obj=Styler(horizontal_alignment=utils.horizontal_alignments.right),
+    parser.add_argument(
+        "-be",
+        "--bin_edges",
+        metavar="binedge",
+        nargs="+",
+        type=float,
+        default=external_bin_edges,
+        help="Optionally specify the bucket edges in seconds of the external comparison results. Default is 0.8 1.7 2.9 5 10 30 90",
     )
-    styled_top_level_summary.apply_column_style(
-        cols_to_style=[
-            "Pageview % Change",
-            "Page Load Time % Change",
-            "Server Response Time % Change",
-        ],
-        styler_obj=Styler(
-            number_format=utils.number_formats.percent,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
+    parser.add_argument(
+        "-em",
+        "--external_metric",
+        metavar="metric",
+        type=str,
+        choices=["plt", "srt"],
+        default="plt",
+        help="Optionally bucket the external comparison results by server response time (srt) instead of page load time (plt)",
     )
-    styled_top_level_summary.apply_column_style(
-        cols_to_style=["Page Load Times (sec)", "Server Response Times (sec)"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_float,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
+    parser.add_argument(
+        "-eb",
+        "--excel_backend",
+        metavar="backend",
+        type=str,
+        choices=["styleframe", "streaming"],
+        default="styleframe",
+        help="Optionally write the results workbook with a write-only streaming backend (streaming) instead of StyleFrame (styleframe)",
     )
-
-    external_comparison_summary = create_external_metrics(
-        current_raw_results, current_grouped_by_url
+    parser.add_argument(
+        "-f",
+        "--format",
+        metavar="format",
+        type=str,
+        choices=["xlsx", "parquet", "csv", "json"],
+        default="xlsx",
+        help="Optionally write the results as a directory of Parquet, CSV or JSON files with a manifest instead of a styled workbook. Default is xlsx",
     )
-    styled_external_comparison_summary = StyleFrame(external_comparison_summary)
-    style_header_row(styled_external_comparison_summary)
-    styled_external_comparison_summary.apply_column_style(
-        cols_to_style=["Metrics"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general,
-            horizontal_alignment=utils.horizontal_alignments.left,
-        ),
+    parser.add_argument(
+        "-w",
+        "--workers",
+        metavar="workers",
+        type=int,
+        default=4,
+        help="Optionally specify the number of threads the results sheets are built and styled on. Default is 4",
     )
-    styled_external_comparison_summary.apply_column_style(
-        cols_to_style=["Percent of Total Page URLs", "Percent of Total Pageviews"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.percent,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
+    parser.add_argument(
+        "-sr",
+        "--source_reader",
+        metavar="reader",
+        type=str,
+        choices=["csv"] + list(source_readers),
+        default="csv",
+        help="Optionally read the source table as Arrow record batches straight from BigQuery (bigquery) or from the local Parquet or Arrow IPC input file (arrow_file) instead of the CSV export (csv)",
     )
-    styled_external_comparison_summary.apply_column_style(
-        cols_to_style=["Number of Page URLs", "Number of Pageviews"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_integer,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
+    parser.add_argument(
+        "-tr",
+        "--trend",
+        metavar=("startdate", "enddate"),
+        nargs=2,
+        type=str,
+        help="If a first and last date are specified as (yyyymmdd) format, write the per URL and site wide averages of every --time_frame window between them instead of comparing two timeframes",
     )
-
-    previous_grouped_by_page_path = group_by_page_path(previous_raw_results)
-    current_grouped_by_page_path = group_by_page_path(current_raw_results)
-
-    calculated_grouped_by_page_path = create_grouped_by_page_path(
-        previous_grouped_by_page_path, current_grouped_by_page_path
+    parser.add_argument(
+        "-ts",
+        "--trend_step",
+        metavar="days",
+        type=int,
+        help="Optionally specify the number of days between the start dates of consecutive trend windows. Default is the window length, so windows do not overlap",
     )
-    styled_calculated_grouped_by_page_path = StyleFrame(calculated_grouped_by_page_path)
-    style_header_row(styled_calculated_grouped_by_page_path)
-    styled_calculated_grouped_by_page_path.apply_column_style(
-        cols_to_style=["page_path_one"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general,
-            horizontal_alignment=utils.horizontal_alignments.left,
-        ),
+    parser.add_argument(
+        "-cd",
+        "--result_cache",
+        metavar="cachedir",
+        type=str,
+        help="If a directory is specified, reuse the results and workbook of an earlier run with the same input data, active URLs, arguments and program, and cache the results of new runs",
     )
-    styled_calculated_grouped_by_page_path.apply_column_style(
-        cols_to_style=["pages", "pv"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_integer,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
+    parser.add_argument(
+        "-cs",
+        "--cache_size",
+        metavar="megabytes",
+        type=float,
+        default=result_cache_size_mb,
+        help="Optionally specify the size cap of the result cache, the least recently used results are evicted past it. Default is 1024",
     )
-    styled_calculated_grouped_by_page_path.apply_column_style(
-        cols_to_style=["pv_percent_of_total","pv_percent_change", "plt_percent_change", "srt_percent_change"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.percent,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
+    parser.add_argument(
+        "-sj",
+        "--stage_report",
+        metavar="reportfile",
+        type=str,
+        help="If a path is specified, write the wall time, CPU time, rows and peak memory of every stage of the run to a JSON file. Tracing the memory slows the run down",
     )
-    styled_calculated_grouped_by_page_path.apply_column_style(
-        cols_to_style=["plt_avg","srt_avg"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_float,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
+    parser.add_argument(
+        "-pf",
+        "--profile",
+        metavar="profilefile",
+        type=str,
+        help="If a path is specified, profile the run with cProfile and dump the stats to the file",
     )
+    args = parser.parse_args()
+    startup_duration = time.perf_counter() - startup_start_time
+
+    if len(args.bin_edges) < 2:
+        parser.error("--bin_edges needs at least two bucket edges")
+    if args.raw_datasets is not None and not args.raw_datasets.endswith(
+        raw_dataset_extensions
+    ):
+        parser.error(
+            "--raw_datasets needs one of the extensions {}".format(
+                ", ".join(raw_dataset_extensions)
+            )
+        )
+    if args.source_reader == "arrow_file" and args.input_file is None:
+        parser.error("--source_reader arrow_file needs an --input_file")
+    if args.workers < 1:
+        parser.error("--workers needs at least one thread")
+    if args.cache_size <= 0:
+        parser.error("--cache_size needs to be positive")
+    if args.quantile_sketch is not None:
+        if args.rollup_store is None:
+            parser.error("--quantile_sketch keeps its daily sketches in the rollup store and needs --rollup_store")
+        if not 0 < args.quantile_sketch < 1:
+            parser.error("--quantile_sketch needs a relative accuracy between 0 and 1")
+    if args.trend is None:
+        if args.previous_start_date is None or args.current_start_date is None:
+            parser.error("--previous_start_date and --current_start_date are required unless --trend is specified")
+        time_frames = {
+            "previous": time_frame_bounds(args.previous_start_date[0], args.time_frame),
+            "current": time_frame_bounds(args.current_start_date[0], args.time_frame),
+        }
+    else:
+        if args.rollup_store is not None:
+            parser.error("--trend reads the source dataset and cannot be combined with --rollup_store")
+        if args.trend_step is None:
+            args.trend_step = args.time_frame + 1
+        if args.trend_step < 1:
+            parser.error("--trend_step needs at least one day")
+        trend_start_date, trend_end_date = pd.to_datetime(args.trend, format="%Y%m%d")
+        if trend_end_date < trend_start_date + pd.DateOffset(days=args.time_frame):
+            parser.error("--trend needs to span at least one --time_frame window")
+        # The trend windows are all read in one timeframe spanning the first and last date
+        time_frames = {"trend": (trend_start_date, trend_end_date)}
+
+    if args.stage_report is not None:
+        global trace_stage_memory
+        trace_stage_memory = True
+        tracemalloc.start()
+    if args.profile is not None:
+        # Only the main thread is profiled, the concurrent sheet builders show up as waits
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    results = None
+    if args.result_cache is not None:
+        cache_entry = os.path.join(
+            args.result_cache, run_stage("fingerprint_inputs", result_cache_key, args)
+        )
+        if args.raw_datasets is not None:
+            print("Skipped reading the result cache, raw datasets are always recalculated")
+        elif args.refresh_cache:
+            print("Skipped reading the result cache, the stores are being rebuilt")
+        else:
+            results = run_stage("read_result_cache", read_result_cache, cache_entry)
+
+    if results is not None:
+        print("\nResults read from the result cache\n")
+        cached_workbook = result_cache_workbook(cache_entry, args.excel_backend)
+    else:
+        cached_workbook = None
+        # If the user did not specify
+        if args.active_urls_file is None:
+
+            print("Getting active URLs file from GCS")
+            with instrument_stage("load_active_urls") as stage:
+                headstart_active_urls = pd.read_csv(
+                    bucket_location_for_active_urls,
+                    encoding="latin-1",
+                    storage_options={"token": load_credentials()},
+                )
+                stage["rows_out"] = len(headstart_active_urls)
+            print("Active URLs file read from GCS")
+
+        else:
+            print("Reading active URLs file from path")
+            with instrument_stage("load_active_urls") as stage:
+                headstart_active_urls = pd.read_csv(args.active_urls_file, encoding="latin-1")
+                stage["rows_out"] = len(headstart_active_urls)
+
+        if args.trend is not None:
+            results = calculate_trend_results(args, time_frames, headstart_active_urls)
+            raw_results = None
+        else:
+            results, raw_results = calculate_report_results(
+                args, time_frames, headstart_active_urls
+            )
 
-    top_pageview_changes = create_top_pageview_changes(calculated_grouped_by_page_url)
-    styled_top_pageview_changes = StyleFrame(top_pageview_changes)
-    style_header_row(styled_top_pageview_changes)
-    styled_top_pageview_changes.apply_column_style(
-        cols_to_style=["page_url_cleaned"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general,
-            horizontal_alignment=utils.horizontal_alignments.left,
-        ),
-    )
-    styled_top_pageview_changes.apply_column_style(
-        cols_to_style=["pv_current"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_integer,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
-    styled_top_pageview_changes.apply_column_style(
-        cols_to_style=["pv_percent_of_total","pv_percent_change"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.percent,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
+        if args.raw_datasets is None:
+            print("\nSkipped writing raw datasets to file\n")
 
-    change_outliers = create_change_outliers(calculated_grouped_by_page_url)
-    styled_change_outliers = StyleFrame(change_outliers)
-    style_header_row(styled_change_outliers)
-    styled_change_outliers.apply_column_style(
-        cols_to_style=["page_url_cleaned"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general,
-            horizontal_alignment=utils.horizontal_alignments.left,
-        ),
-    )
-    styled_change_outliers.apply_column_style(
-        cols_to_style=["pv_current"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_integer,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
-    styled_change_outliers.apply_column_style(
-        cols_to_style=["plt_avg_current","srt_avg_current"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_float,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
-    styled_change_outliers.apply_column_style(
-        cols_to_style=["pv_percent_of_total","plt_percent_change", "srt_percent_change"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.percent,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
-    styled_change_outliers.apply_column_style(
-        cols_to_style=["outlier_value"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
+        elif raw_results is None:
+            print("\nSkipped writing raw datasets to file, rollup store and trend runs hold no raw events\n")
 
-    current_outliers = create_current_outliers(
-        current_raw_results, calculated_grouped_by_page_url
-    )
-    styled_current_outliers = StyleFrame(current_outliers)
-    style_header_row(styled_current_outliers)
-    styled_current_outliers.apply_column_style(
-        cols_to_style=["page_url_cleaned"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general,
-            horizontal_alignment=utils.horizontal_alignments.left,
-        ),
-    )
-    styled_current_outliers.apply_column_style(
-        cols_to_style=["pv_current"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_integer,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
-    styled_current_outliers.apply_column_style(
-        cols_to_style=["plt_avg_current","srt_avg_current"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general_float,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
-    styled_current_outliers.apply_column_style(
-        cols_to_style=["pv_percent_of_total","plt_percent_change", "srt_percent_change"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.percent,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
-    styled_current_outliers.apply_column_style(
-        cols_to_style=["outlier_value"],
-        styler_obj=Styler(
-            number_format=utils.number_formats.general,
-            horizontal_alignment=utils.horizontal_alignments.right,
-        ),
-    )
+        else:
+            run_stage(
+                "write_raw_datasets",
+                write_raw_datasets,
+                raw_results,
+                args.raw_datasets,
+                args.raw_columns,
+            )
 
-    styled_calculated_grouped_by_page_url = StyleFrame(calculated_grouped_by_page_url)
-    style_header_row(styled_calculated_grouped_by_page_url)
-    styled_calculated_grouped_by_page_url.apply_style_by_indexes(
-        indexes_to_style=styled_calculated_grouped_by_page_url[
-            styled_calculated_grouped_by_page_url["outlier_value"] != "N/A"
-        ],
-        styler_obj=Styler(bg_color="#F25454", bold=True, horizontal_alignment=utils.horizontal_alignments.right),
-    )
-    styled_calculated_grouped_by_page_url.apply_style_by_indexes(
-        indexes_to_style=styled_calculated_grouped_by_page_url[
-            styled_calculated_grouped_by_page_url["outlier_value"] == "N/A"
-        ],
-        styler_obj=Styler(horizontal_alignment=utils.horizontal_alignments.right),
-    )
+    # Write out all of the dataframe results to their respective sheets in an excel file
+    if args.format != "xlsx":
+        # The results bundle is a directory named after the output file without its extension
+        output_dir = args.output_file
+        if output_dir.endswith(".xlsx"):
+            output_dir = output_dir[: -len(".xlsx")]
+        write_results_bundle(results, output_dir, args.format, time_frames)
+    elif cached_workbook is not None and os.path.isfile(cached_workbook):
+        shutil.copyfile(cached_workbook, args.output_file)
+        print("Workbook copied from the result cache")
+    elif args.excel_backend == "streaming":
+        write_streaming_workbook(results, args.output_file)
+    else:
+        write_styled_workbook(results, args.output_file, args.workers)
 
-    if args.raw_datasets is None:
-        print("\nSkipped writing raw datasets to file\n")
+    print("Results finalized.")
 
-    else:
-        with pd.ExcelWriter(args.raw_datasets) as writer:
-            print("\nWriting datasets to file:")
-            previous_raw_results.to_excel(
-                writer,
-                sheet_name="previous_raw_results",
-                index=False,
-                freeze_panes=(1, 0),
+    stale_stores = []
+    if args.result_cache is not None and store_in_use(args):
+        # Results read from a store written from another source would be cached under the key of the current source
+        current_source = source_fingerprint(args)
+        stale_stores = [
+            store_name
+            for store_name, store_source in store_sources(args).items()
+            if store_source != current_source
+        ]
+        if stale_stores:
+            print(
+                "Skipped writing the result cache, the {} was not written from the current source".format(
+                    " and ".join(stale_stores)
+                )
             )
-            print("Previous Raw Results written")
+        else:
+            # Building or updating a store changes its fingerprint, so the results are cached under the key of the stores
+            # as they are now, the key the next identical run looks up
+            cache_entry = os.path.join(args.result_cache, result_cache_key(args))
+
+    if args.result_cache is not None and not stale_stores:
+        run_stage(
+            "write_result_cache",
+            write_result_cache,
+            cache_entry,
+            results,
+            args.output_file if args.format == "xlsx" else None,
+            args.excel_backend,
+        )
+        evict_result_cache(args.result_cache, args.cache_size * 2**20, cache_entry)
 
-            current_raw_results.to_excel(
-                writer,
-                sheet_name="current_raw_results",
-                index=False,
-                freeze_panes=(1, 0),
-            )
-            print("Current Raw Results written")
+    if args.profile is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print("Profile written to {}".format(args.profile))
+    if args.stage_report is not None:
+        write_stage_report(args.stage_report, startup_duration)
+        print("Stage report written to {}".format(args.stage_report))
 
-    # Write out all of the dataframe results to their respective sheets in an excel file
-    with StyleFrame.ExcelWriter(args.output_file) as writer:
-        print("\nWriting results to file:")
-        styled_top_level_summary.to_excel(
-            writer,
-            sheet_name="top_level",
-            index=False,
-            freeze_panes=(1, 0),
-            row_to_add_filters=0,
-            best_fit=list(styled_top_level_summary.columns),
-        )
-        print("Top Level Summary Results written")
-
-        styled_external_comparison_summary.to_excel(
-            writer,
-            sheet_name="external_comparison",
-            index=False,
-            freeze_panes=(1, 0),
-            row_to_add_filters=0,
-            best_fit=list(styled_external_comparison_summary.columns),
+    # upload_file = client.folder(config("box_folder_for_uploads")).upload(args.output_file, file_name="results_{start_value}-{end_value}-{datetime_now}.xlsx".format(start_value = args.previous_start_date[0], end_value= args.current_start_date[0], datetime_now = datetime.datetime.now().strftime("%H%M%S")), file_description="Sample Description")
+    program_end_time = datetime.datetime.now()
+    print("\nProgram Startup Duration: {:0.3f} secs".format(startup_duration))
+    # print("Results uploaded to Box here: https://app.box.com/file/{file_id}".format(file_id = upload_file.id))
+    print(
+        "\nProgram Runtime Duration: {}\n".format(program_end_time - program_start_time)
+    )
+
+
+"""
+Function for calculating the results sheets of the previous and current timeframes, from the source dataset or the rollup store
+
+@param args: parsed command line arguments
+@param time_frames: dict of the previous and current timeframe labels to (start, end) timestamps
+@param headstart_active_urls: dataframe of the active URLs
+@param loaded_source: optional (source dataset, URL table) already loaded, such as the ones a report daemon holds in memory
+"""
+def calculate_report_results(args, time_frames, headstart_active_urls, loaded_source=None):
+    if loaded_source is not None:
+        source_dataset, url_table = loaded_source
+    elif args.rollup_store is None:
+        source_dataset = load_source_dataset(args, time_frames)
+        url_table = run_stage("build_url_table", build_url_table, source_dataset, headstart_active_urls)
+
+    if args.rollup_store is None:
+
+        print("\nCalculating results:")
+        # Every timeframe is tagged and grouped together in one pass over the source dataset
+        time_frame_results = run_stage(
+            "calculate_time_frames", calculate_time_frames, time_frames, source_dataset, url_table
         )
-        print("External Comparison Summary Results written")
-
-        styled_calculated_grouped_by_page_path.to_excel(
-            writer,
-            sheet_name="grouped_by_page_path",
-            index=False,
-            freeze_panes=(1, 0),
-            row_to_add_filters=0,
-            best_fit=list(styled_calculated_grouped_by_page_path.columns),
+        raw_results = run_stage("split_time_frames", split_time_frames, time_frame_results)
+        grouped_by_url = run_stage(
+            "group_by_page_url",
+            group_by_time_frames,
+            time_frame_results,
+            "page_url_cleaned",
+            page_url_aggregations,
         )
-        print("Grouped by Page Path Results written")
-
-        styled_calculated_grouped_by_page_url.to_excel(
-            writer,
-            sheet_name="grouped_by_page_url",
-            index=False,
-            freeze_panes=(1, 0),
-            row_to_add_filters=0,
-            best_fit=list(styled_calculated_grouped_by_page_url.columns),
+        grouped_by_page_path = run_stage(
+            "group_by_page_path",
+            group_by_time_frames,
+            time_frame_results,
+            "page_path_one",
+            page_path_aggregations,
         )
-        print("Grouped by Page URL Results written")
-
-        styled_top_pageview_changes.to_excel(
-            writer,
-            sheet_name="top_pageview_changes",
-            index=False,
-            freeze_panes=(1, 0),
-            row_to_add_filters=0,
-            best_fit=list(styled_top_pageview_changes.columns),
+        histograms = {
+            time_frame: run_stage(
+                "build_histograms_" + time_frame, build_histograms, raw_results[time_frame]
+            )
+            for time_frame in time_frames
+        }
+    else:
+        rollup_manifest = read_rollup_manifest(args.rollup_store)
+        active_urls_key = active_urls_fingerprint(headstart_active_urls)
+        quantile_sketch = None
+        if args.quantile_sketch is not None:
+            quantile_sketch = {"accuracy": args.quantile_sketch, "bin_edges": sorted(args.bin_edges)}
+        # Rollups only hold the active URLs, so a store built from another active URLs list, layout or sketch is rebuilt
+        if os.path.isdir(args.rollup_store) and (
+            args.refresh_cache
+            or rollup_manifest is None
+            or rollup_manifest.get("version") != rollup_store_version
+            or rollup_manifest["active_urls"] != active_urls_key
+            or rollup_manifest.get("quantile_sketch") != quantile_sketch
+        ):
+            if not args.refresh_cache:
+                print("The rollup store was built from other active URLs, layout or quantile sketch, rebuilding it")
+            shutil.rmtree(args.rollup_store)
+            rollup_manifest = None
+
+        # The source dataset is only loaded when the rollup store is missing days of a timeframe
+        source_key = source_fingerprint(args)
+        rollup_days = missing_rollup_days(rollup_manifest, time_frames, source_key)
+        if rollup_days:
+            source_dataset = load_source_dataset(args, time_frames)
+            url_table = run_stage(
+                "build_url_table", build_url_table, source_dataset, headstart_active_urls
+            )
+            print("Adding {} days to the rollup store".format(len(rollup_days)))
+            run_stage(
+                "update_rollup_store",
+                update_rollup_store,
+                args.rollup_store,
+                source_dataset,
+                url_table,
+                rollup_days,
+                {
+                    "version": rollup_store_version,
+                    "active_urls": active_urls_key,
+                    "source": source_key,
+                    "quantile_sketch": quantile_sketch,
+                },
+            )
+
+        print("Reading timeframes from the rollup store")
+        url_rollups, latency_rollups = run_stage(
+            "read_rollup_store", read_rollup_store, args.rollup_store, time_frames
         )
-        print("Top Pageview Change Results written")
-
-        styled_change_outliers.to_excel(
-            writer,
-            sheet_name="change_outliers",
-            index=False,
-            freeze_panes=(1, 0),
-            row_to_add_filters=0,
-            best_fit=list(styled_change_outliers.columns),
+
+        print("\nCalculating results:")
+        raw_results = None
+        grouped_by_url = run_stage(
+            "group_by_page_url",
+            group_rollups_by_time_frames,
+            url_rollups,
+            time_frames,
+            "page_url_cleaned",
+            page_url_rollup_aggregations,
+        )
+        grouped_by_page_path = run_stage(
+            "group_by_page_path",
+            group_rollups_by_time_frames,
+            url_rollups,
+            time_frames,
+            "page_path_one",
+            page_path_rollup_aggregations,
+        )
+        histograms = run_stage(
+            "histograms_from_rollups", histograms_from_rollups, latency_rollups, time_frames
+        )
+        if args.quantile_sketch is not None:
+            timing_totals = run_stage(
+                "timing_totals_from_rollups", timing_totals_from_rollups, url_rollups, time_frames
+            )
+
+    previous_grouped_by_url = grouped_by_url["previous"]
+    current_grouped_by_url = grouped_by_url["current"]
+
+    calculated_grouped_by_page_url = run_stage(
+        "merge_groups_by_page_url",
+        merge_groups_by_page_url,
+        previous_grouped_by_url,
+        current_grouped_by_url,
+    )
+
+    if args.quantile_sketch is None:
+        previous_summary = run_stage(
+            "summarize_previous",
+            summarize_time_frame,
+            histograms["previous"],
+            previous_grouped_by_url,
+        )
+        current_summary = run_stage(
+            "summarize_current",
+            summarize_time_frame,
+            histograms["current"],
+            current_grouped_by_url,
+        )
+    else:
+        previous_summary = run_stage(
+            "summarize_previous",
+            summarize_sketched_time_frame,
+            histograms["previous"],
+            previous_grouped_by_url,
+            timing_totals["previous"],
+            args.quantile_sketch,
+        )
+        current_summary = run_stage(
+            "summarize_current",
+            summarize_sketched_time_frame,
+            histograms["current"],
+            current_grouped_by_url,
+            timing_totals["current"],
+            args.quantile_sketch,
+        )
+
+    # Every sheet only reads the merged and summarized timeframes, so the sheets are built concurrently
+    sheet_builders = {
+        "top_level": (create_top_results, (previous_summary, current_summary)),
+        "external_comparison": (
+            create_external_metrics,
+            (
+                histograms["current"][args.external_metric + "_sec"],
+                current_grouped_by_url,
+                args.external_metric,
+                sorted(args.bin_edges),
+            ),
+        ),
+        "grouped_by_page_path": (
+            create_grouped_by_page_path,
+            (grouped_by_page_path["previous"], grouped_by_page_path["current"]),
+        ),
+        "grouped_by_page_url": (
+            create_grouped_by_page_url,
+            (current_summary, calculated_grouped_by_page_url),
+        ),
+        "top_pageview_changes": (
+            create_top_pageview_changes,
+            (calculated_grouped_by_page_url,),
+        ),
+        "change_outliers": (create_change_outliers, (calculated_grouped_by_page_url,)),
+        "current_outliers": (
+            create_current_outliers,
+            (current_summary, calculated_grouped_by_page_url),
+        ),
+    }
+    # Results in the order of the sheets of the workbook
+    results = run_concurrently(
+        {
+            sheet_name: (run_stage, (builder.__name__, builder) + builder_args)
+            for sheet_name, (builder, builder_args) in sheet_builders.items()
+        },
+        args.workers,
+    )
+
+    return results, raw_results
+
+
+"""
+Function for calculating the trend results of every window between the first and last trend dates from one pass over the source dataset
+
+@param args: parsed command line arguments
+@param time_frames: dict of the single trend timeframe label to its (start, end) timestamps
+@param headstart_active_urls: dataframe of the active URLs
+"""
+def calculate_trend_results(args, time_frames, headstart_active_urls):
+    source_dataset = load_source_dataset(args, time_frames)
+    url_table = run_stage("build_url_table", build_url_table, source_dataset, headstart_active_urls)
+
+    print("\nCalculating trend results:")
+    time_frame_results = run_stage(
+        "calculate_time_frames", calculate_time_frames, time_frames, source_dataset, url_table
+    )
+    trend_start_date, trend_end_date = time_frames["trend"]
+    url_day_matrix = run_stage(
+        "build_url_day_matrix",
+        build_url_day_matrix,
+        time_frame_results,
+        trend_start_date,
+        trend_end_date,
+    )
+    windows = trend_windows(trend_start_date, trend_end_date, args.time_frame, args.trend_step)
+    print("{} trend windows of {} days".format(len(windows), args.time_frame + 1))
+
+    return run_stage("calculate_trend_windows", calculate_trend_windows, url_day_matrix, windows)
+
+
+"""
+Function for a dense URL by day matrix of the pageview counts, timing sums and timing counts of the trend events
+
+@param time_frame_result: dataframe of the cleaned events of the trend timeframe
+@param start_date: first day of the matrix
+@param end_date: last day of the matrix
+"""
+def build_url_day_matrix(time_frame_result, start_date, end_date):
+    page_urls = time_frame_result["page_url_cleaned"].cat.remove_unused_categories()
+    days = (end_date - start_date).days + 1
+    day_index = (time_frame_result["event_date"] - start_date).dt.days.to_numpy()
+
+    # Each event lands in the flattened (URL, day) cell of the matrix
+    cells = page_urls.cat.codes.to_numpy().astype(np.int64) * days + day_index
+    shape = (len(page_urls.cat.categories), days)
+
+    def cell_totals(weights=None):
+        return np.bincount(cells, weights=weights, minlength=shape[0] * days).reshape(shape)
+
+    url_day_matrix = {
+        "start_date": start_date,
+        "page_urls": page_urls.cat.categories,
+        "pv": cell_totals(),
+    }
+    for metric in ["plt", "srt"]:
+        values = time_frame_result[metric + "_sec"].to_numpy(dtype=float)
+        has_value = ~np.isnan(values)
+        # Missing timings count as pageviews but are left out of the timing averages
+        url_day_matrix[metric + "_sum"] = cell_totals(np.where(has_value, values, 0))
+        url_day_matrix[metric + "_count"] = cell_totals(has_value.astype(float))
+    return url_day_matrix
+
+
+"""
+Helper function for the (first, last) day offsets of the sliding trend windows that fit between the trend dates
+
+@param start_date: first trend date
+@param end_date: last trend date
+@param window: number of days after the first day that each window spans
+@param step: number of days between the first days of consecutive windows
+"""
+def trend_windows(start_date, end_date, window, step):
+    days = (end_date - start_date).days + 1
+    return [(first_day, first_day + window) for first_day in range(0, days - window, step)]
+
+
+"""
+Function for the per URL and site wide results of every trend window, with each window summed from the cumulative daily totals
+
+@param url_day_matrix: dict of the URLs and their dense URL by day totals
+@param windows: list of (first, last) day offsets of the trend windows
+"""
+def calculate_trend_windows(url_day_matrix, windows):
+    first_days = np.array([first_day for first_day, _ in windows])
+    last_days = np.array([last_day for _, last_day in windows])
+
+    # A leading column of zeros makes the sum of days first through last the difference of two prefix sums
+    window_totals = {}
+    for total in ["pv", "plt_sum", "plt_count", "srt_sum", "srt_count"]:
+        prefix_sums = np.cumsum(url_day_matrix[total], axis=1)
+        prefix_sums = np.hstack([np.zeros((prefix_sums.shape[0], 1), dtype=prefix_sums.dtype), prefix_sums])
+        window_totals[total] = prefix_sums[:, last_days + 1] - prefix_sums[:, first_days]
+
+    pv = window_totals["pv"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        plt_avg = window_totals["plt_sum"] / window_totals["plt_count"]
+        srt_avg = window_totals["srt_sum"] / window_totals["srt_count"]
+
+    start_date = url_day_matrix["start_date"]
+    window_start = [(start_date + pd.DateOffset(days=int(day))).strftime("%Y-%m-%d") for day in first_days]
+    window_end = [(start_date + pd.DateOffset(days=int(day))).strftime("%Y-%m-%d") for day in last_days]
+
+    # Site wide averages weight each URL's average by its pageviews, like the top level summary
+    trend_site = pd.DataFrame(
+        {
+            "window_start": window_start,
+            "window_end": window_end,
+            "pages": (pv > 0).sum(axis=0),
+            "pv": pv.sum(axis=0),
+            "plt_avg": np.nansum(plt_avg * pv, axis=0) / pv.sum(axis=0),
+            "srt_avg": np.nansum(srt_avg * pv, axis=0) / pv.sum(axis=0),
+        }
+    )
+    for metric in ["pv", "plt_avg", "srt_avg"]:
+        trend_site[metric.split("_")[0] + "_percent_change"] = trend_site[metric].pct_change()
+
+    url_rows, window_columns = np.nonzero(pv)
+    trend_url = pd.DataFrame(
+        {
+            "window_start": np.array(window_start)[window_columns],
+            "window_end": np.array(window_end)[window_columns],
+            "page_url_cleaned": np.asarray(url_day_matrix["page_urls"])[url_rows],
+            "pv": pv[url_rows, window_columns],
+            "plt_avg": plt_avg[url_rows, window_columns],
+            "srt_avg": srt_avg[url_rows, window_columns],
+        }
+    )
+    trend_url = trend_url.sort_values(
+        ["window_start", "pv", "page_url_cleaned"], ascending=[True, False, True]
+    ).reset_index(drop=True)
+
+    return {"trend_site": trend_site, "trend_url": trend_url}
+
+
+"""
+Function for running independent tasks on a thread pool, returning their results once all of them have finished
+
+@param tasks: dict of task name to (function, args), in the order of the results
+@param workers: number of threads the tasks are run on
+"""
+def run_concurrently(tasks, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            name: executor.submit(function, *function_args)
+            for name, (function, function_args) in tasks.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+"""
+Helper function for the number of rows of the dataframes among the values, looking into dicts of dataframes
+
+@param values: values a stage takes or returns
+"""
+def count_rows(*values):
+    rows = None
+    for value in values:
+        if isinstance(value, dict):
+            value_rows = count_rows(*value.values())
+        elif isinstance(value, (tuple, list)):
+            value_rows = count_rows(*value)
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            value_rows = len(value)
+        else:
+            value_rows = None
+        if value_rows is not None:
+            rows = (rows or 0) + value_rows
+    return rows
+
+
+"""
+Context manager recording the wall time, CPU time and peak memory of a stage in stage_records
+The caller can set rows_in and rows_out on the yielded record
+
+@param name: name of the stage in the report
+@param rows_in: optional number of rows the stage takes
+"""
+@contextlib.contextmanager
+def instrument_stage(name, rows_in=None):
+    record = {"name": name, "rows_in": rows_in, "rows_out": None}
+    if trace_stage_memory:
+        with open_stage_lock:
+            fold_traced_peak()
+            tracemalloc.reset_peak()
+            open_stage_peaks[id(record)] = tracemalloc.get_traced_memory()[0]
+    wall_start_time = time.perf_counter()
+    cpu_start_time = time.process_time()
+    try:
+        yield record
+    finally:
+        record["started_seconds"] = round(wall_start_time - startup_start_time, 4)
+        record["wall_seconds"] = round(time.perf_counter() - wall_start_time, 4)
+        # Process CPU time, which includes any threads working at the same time
+        record["cpu_seconds"] = round(time.process_time() - cpu_start_time, 4)
+        if trace_stage_memory:
+            with open_stage_lock:
+                fold_traced_peak()
+                record["peak_traced_mb"] = round(open_stage_peaks.pop(id(record)) / 2**20, 1)
+        stage_records.append(record)
+
+
+"""
+Helper function for folding the traced peak since the last reset into every open stage, called before each reset
+so an inner or concurrent stage never loses the peak of a stage around it. Stages running at the same time share
+their peaks, so the peak of a concurrent stage is an upper bound
+"""
+def fold_traced_peak():
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    for stage_id, stage_peak in open_stage_peaks.items():
+        open_stage_peaks[stage_id] = max(stage_peak, traced_peak)
+
+
+"""
+Helper function for running a function as an instrumented stage, counting the rows of the dataframes it takes and returns
+
+@param name: name of the stage in the report
+@param function: function run by the stage
+@param function_args: positional arguments of the function
+"""
+def run_stage(name, function, *function_args):
+    with instrument_stage(name, rows_in=count_rows(*function_args)) as record:
+        result = function(*function_args)
+        record["rows_out"] = count_rows(result)
+    return result
+
+
+"""
+Function for writing the stage records of the run to a JSON report
+
+@param report_file: path of the JSON report
+@param startup_duration: seconds from the top of the module to the parsed arguments
+"""
+def write_stage_report(report_file, startup_duration):
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "arguments": sys.argv[1:],
+        "startup_seconds": round(startup_duration, 4),
+        "total_seconds": round(time.perf_counter() - startup_start_time, 4),
+        "memory_traced": trace_stage_memory,
+        "stages": stage_records,
+    }
+    with open(report_file, "w") as report_output:
+        json.dump(report, report_output, indent=2)
+
+
+"""
+Helper function for the service account credentials of GCS and BigQuery, read from the service account file on first use
+"""
+@functools.lru_cache(maxsize=None)
+def load_credentials():
+    from google.oauth2 import service_account
+
+    return service_account.Credentials.from_service_account_file(
+        service_account_file,
+        scopes=["https://www.googleapis.com/auth/cloud-platform"],
+    )
+
+
+"""
+Helper function for the first and last day of a timeframe, inclusive of both
+
+@param start_date: string representation of a datetime
+@param window: timeframe lookup (default is two weeks)
+"""
+def time_frame_bounds(start_date, window):
+    start_date = pd.to_datetime(start_date)
+    end_date = start_date + pd.DateOffset(days=window)
+    return start_date, end_date
+
+
+"""
+Helper function for flagging the rows whose event_date falls within any of the timeframes
+
+@param event_dates: raw event_date values in yyyymmdd integer format
+@param time_frames: dict of timeframe label to (start, end) timestamps
+"""
+def in_time_frames(event_dates, time_frames):
+    in_any_time_frame = pd.Series(False, index=event_dates.index)
+    for start_date, end_date in time_frames.values():
+        in_any_time_frame |= event_dates.between(
+            int(start_date.strftime("%Y%m%d")),
+            int(end_date.strftime("%Y%m%d")),
+            inclusive="both",
         )
-        print("Change Outlier Results written")
-
-        styled_current_outliers.to_excel(
-            writer,
-            sheet_name="current_outliers",
-            index=False,
-            freeze_panes=(1, 0),
-            row_to_add_filters=0,
-            best_fit=list(styled_current_outliers.columns),
+    return in_any_time_frame
+
+
+"""
+Function for streaming the raw source file in chunks, dropping rows outside the timeframes as each chunk is parsed
+
+@param source_file: path, URL or open file of the raw source file
+@param time_frames: dict of timeframe label to (start, end) timestamps to keep, None keeps every row
+@param storage_options: optional storage options passed through for remote files such as GCS
+"""
+def read_source_file(source_file, time_frames, storage_options=None):
+    chunks = []
+    with pd.read_csv(
+        source_file,
+        encoding="latin-1",
+        storage_options=storage_options,
+        usecols=source_columns,
+        dtype={column: "category" for column in categorical_columns},
+        chunksize=source_chunk_size,
+    ) as reader:
+        for chunk in reader:
+            if time_frames is not None:
+                chunk = chunk[in_time_frames(chunk["event_date"], time_frames)]
+            chunks.append(chunk)
+
+    if not chunks:
+        return pd.DataFrame(columns=source_columns)
+
+    # Each chunk has its own categories, align them so the concatenated columns stay categorical
+    for column in categorical_columns:
+        categories = union_categoricals(
+            [chunk[column] for chunk in chunks], sort_categories=True
+        ).categories
+        for chunk in chunks:
+            chunk[column] = chunk[column].cat.set_categories(categories)
+
+    # The chunk indexes continue across chunks, so the original row numbers are kept
+    return pd.concat(chunks)
+
+
+"""
+Function for turning Arrow record batches of the raw source table into the typed source dataset, dropping rows outside the timeframes batch by batch
+
+@param record_batches: iterable of pyarrow record batches holding the source columns
+@param time_frames: dict of timeframe label to (start, end) timestamps to keep, None keeps every row
+"""
+def read_source_batches(record_batches, time_frames):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    tables = []
+    for record_batch in record_batches:
+        if time_frames is not None:
+            event_dates = pd.Series(
+                record_batch.column(record_batch.schema.get_field_index("event_date"))
+                .to_numpy(zero_copy_only=False)
+            ).astype("int64")
+            record_batch = record_batch.filter(
+                pa.array(in_time_frames(event_dates, time_frames).to_numpy())
+            )
+        # Dictionary encoded strings become categoricals without a Python string per row
+        source_table = pa.Table.from_batches([record_batch]).select(source_columns)
+        for column in categorical_columns:
+            source_table = source_table.set_column(
+                source_table.schema.get_field_index(column),
+                column,
+                pc.dictionary_encode(source_table[column]),
+            )
+        tables.append(source_table)
+
+    if not tables:
+        return pd.DataFrame(columns=source_columns)
+
+    # Each batch has its own dictionaries, which are unified when converted to pandas
+    source_dataset = pa.concat_tables(tables).to_pandas()
+
+    # Sort the categories like the CSV reader does so URL IDs and group order match
+    for column in categorical_columns:
+        source_dataset[column] = source_dataset[column].cat.reorder_categories(
+            source_dataset[column].cat.categories.sort_values()
+        )
+    return source_dataset
+
+
+"""
+Record batch reader for the page_performance_results table in BigQuery, pushing the timeframes down into the query
+
+@param args: parsed command line arguments
+@param time_frames: dict of timeframe label to (start, end) timestamps to keep, None reads every event_date
+"""
+def read_bigquery_batches(args, time_frames):
+    selected_columns = [
+        "CAST(event_date AS INT64) AS event_date" if column == "event_date" else column
+        for column in source_columns
+    ]
+    query = "SELECT {} FROM `{}`".format(", ".join(selected_columns), bq_table)
+    if time_frames is not None:
+        # Filtering on the partition column only scans the partitions of the timeframes
+        query += " WHERE " + " OR ".join(
+            "{} BETWEEN DATE '{}' AND DATE '{}'".format(
+                bq_partition_column,
+                start_date.strftime("%Y-%m-%d"),
+                end_date.strftime("%Y-%m-%d"),
+            )
+            for start_date, end_date in time_frames.values()
+        )
+
+    from google.cloud import bigquery
+
+    credentials = load_credentials()
+    bq_client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+    return bq_client.query(query).result().to_arrow_iterable()
+
+
+"""
+Record batch reader standing in for BigQuery with a local Parquet or Arrow IPC file of the source table
+
+@param args: parsed command line arguments, input_file is the Parquet (.parquet) or Arrow IPC file
+@param time_frames: unused, the rows are filtered as the batches are read
+"""
+def read_arrow_file_batches(args, time_frames):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    source_path = args.input_file.name
+    if source_path.endswith(".parquet"):
+        return pq.ParquetFile(source_path).iter_batches(
+            batch_size=source_chunk_size, columns=source_columns
+        )
+
+    # Batches of a memory mapped IPC file are read without copying them into memory first
+    ipc_reader = pa.ipc.open_file(pa.memory_map(source_path))
+    return (
+        ipc_reader.get_batch(batch_index)
+        for batch_index in range(ipc_reader.num_record_batches)
+    )
+
+
+"""
+Function for loading the typed source dataset from the Arrow store, the Parquet cache, GCS or a local file
+
+@param args: parsed command line arguments
+@param time_frames: dict of timeframe label to (start, end) timestamps to be loaded
+"""
+def load_source_dataset(args, time_frames):
+    if args.arrow_store is not None:
+        source_key = source_fingerprint(args)
+        if (
+            not args.refresh_cache
+            and os.path.isfile(args.arrow_store)
+            and store_source_is_current(
+                "Arrow store",
+                read_store_manifest(arrow_store_manifest_file(args.arrow_store)),
+                source_key,
+                time_frames,
+            )
+        ):
+            print("Mapping source dataset from Arrow store")
+            return run_stage("map_arrow_store", read_arrow_store, args.arrow_store, time_frames)
+        # The store needs every event_date, later runs pick their timeframes from it
+        time_frames = None
+
+    source_dataset = run_stage("load_source", read_source_dataset, args, time_frames)
+
+    with instrument_stage("convert_and_clamp", rows_in=len(source_dataset)) as stage:
+        source_dataset["event_date"] = pd.to_datetime(
+            source_dataset["event_date"], format="%Y%m%d"
         )
-        print("Current Outlier Results written")
+        source_dataset["event_timestamp"] = pd.to_datetime(source_dataset["event_timestamp"], unit="us")
+
+        source_dataset.loc[source_dataset['page_load_time_ms'] > 90000, 'page_load_time_ms'] = 90000
+        source_dataset.loc[source_dataset['server_response_time_ms'] > 90000, 'server_response_time_ms'] = 90000
+        stage["rows_out"] = len(source_dataset)
+
+    if args.arrow_store is not None:
+        print("Writing source dataset to Arrow store")
+        run_stage("write_arrow_store", write_arrow_store, source_dataset, args.arrow_store, source_key)
+        print("Arrow store written to {}".format(args.arrow_store))
+
+    return source_dataset
+
+
+"""
+Helper function for the path of the Arrow store manifest, kept next to the IPC file
+
+@param store_file: path of the Arrow IPC file
+"""
+def arrow_store_manifest_file(store_file):
+    return store_file + ".manifest.json"
+
+
+"""
+Function for writing the typed source dataset to an Arrow IPC file sorted by event_date, so each day is a contiguous run of rows
+Timings are kept as plain float64 values with NaN rather than Arrow nulls, and the rows go in a single record batch so every column
+is one contiguous buffer, which lets them be read back without copying
+
+@param source: typed source dataset after the date conversion and timing clamp
+@param store_file: path of the Arrow IPC file
+@param source_key: fingerprint of the source the dataset was read from
+"""
+def write_arrow_store(source, store_file, source_key):
+    import pyarrow as pa
+
+    # A stable sort keeps the file order within each day, so timeframes read back in the order they were loaded
+    source = source.sort_values("event_date", kind="stable")
+    store_table = pa.Table.from_pandas(source, preserve_index=True)
+    for column in ["page_load_time_ms", "server_response_time_ms"]:
+        if source[column].dtype.kind == "f":
+            column_index = store_table.schema.get_field_index(column)
+            store_table = store_table.set_column(
+                column_index,
+                store_table.schema.field(column),
+                pa.array(source[column].to_numpy(), from_pandas=False),
+            )
+
+    # Written under a temporary name so a run mapping the previous store never sees a partial file
+    with pa.OSFile(store_file + ".tmp", "wb") as store_sink:
+        with pa.ipc.new_file(store_sink, store_table.schema) as store_writer:
+            store_writer.write_table(store_table.combine_chunks())
+    os.replace(store_file + ".tmp", store_file)
+    # Written after the store, so a run that sees the new store with the previous manifest rebuilds it rather than trusting it
+    write_store_manifest(
+        arrow_store_manifest_file(store_file), store_source_manifest(source_key, source["event_date"])
+    )
+
+
+"""
+Function for reading the timeframes of the Arrow store through a memory map as one slice of rows, from the first day of the
+earliest timeframe to the last day of the latest. The date, timestamp, timing and category code columns are views of the mapped
+pages, so processes mapping the same store share one copy of them in the page cache, and days between the timeframes are
+mapped but never copied. calculate_time_frames copies the rows of each timeframe out of the slice
+
+@param store_file: path of the Arrow IPC file
+@param time_frames: dict of timeframe label to (start, end) timestamps to be read, None reads every row
+"""
+def read_arrow_store(store_file, time_frames):
+    import pyarrow as pa
+
+    store_table = pa.ipc.open_file(pa.memory_map(store_file, "r")).read_all()
+
+    if time_frames is not None:
+        event_dates = store_table.column("event_date").to_numpy()
+        first_row = min(
+            np.searchsorted(event_dates, np.datetime64(start_date), side="left")
+            for start_date, _ in time_frames.values()
+        )
+        last_row = max(
+            np.searchsorted(event_dates, np.datetime64(end_date), side="right")
+            for _, end_date in time_frames.values()
+        )
+        # A slice of the table only moves the offsets of its buffers, a single slice keeps each column in one chunk
+        store_table = store_table.slice(first_row, max(last_row - first_row, 0))
+
+    # Each column gets its own block so the numeric columns are not consolidated into a copy
+    return store_table.to_pandas(split_blocks=True)
+
+
+"""
+Function for reading the untyped source dataset from the Parquet cache, the source readers, GCS or a local file
+
+@param args: parsed command line arguments
+@param time_frames: dict of timeframe label to (start, end) timestamps to be loaded
+"""
+def read_source_dataset(args, time_frames):
+    cache_is_current = False
+    if args.parquet_cache is not None:
+        source_key = source_fingerprint(args)
+        if not args.refresh_cache and os.path.isdir(args.parquet_cache):
+            cache_is_current = store_source_is_current(
+                "Parquet cache",
+                read_store_manifest(parquet_cache_manifest_file(args.parquet_cache)),
+                source_key,
+                time_frames,
+            )
+
+    if cache_is_current:
+        print("Reading source partitions from Parquet cache")
+        source_dataset = read_parquet_cache(args.parquet_cache, time_frames)
+        print("Source partitions read from Parquet cache")
+    else:
+        # The cache needs every event_date, otherwise only the timeframes are kept
+        if args.parquet_cache is not None:
+            source_time_frames = None
+        else:
+            source_time_frames = time_frames
+
+        if args.source_reader != "csv":
+            print("Reading source record batches with the {} reader".format(args.source_reader))
+            record_batches = source_readers[args.source_reader](args, source_time_frames)
+            source_dataset = read_source_batches(record_batches, source_time_frames)
+            print("Source record batches read")
+        elif args.input_file is None:
+            """print("Getting source file from Box")
+            raw_bq_results_id = config("raw_big_query_results_box_id")
+            raw_results_file_url = client.file(raw_bq_results_id).get_download_url()
+            source_dataset = pd.read_csv(raw_results_file_url, encoding="latin-1",
+                usecols=[
+                    "event_date",
+                    "page_url",
+                    "page_load_time_ms",
+                    "server_response_time_ms",
+                ],
+            )
+            print("Source file read from Box")"""
+
+            print("Getting source file from GCS")
+            source_dataset = read_source_file(
+                bucket_location_for_raw_data,
+                source_time_frames,
+                storage_options={"token": load_credentials()},
+            )
+            print("Source file read from GCS")
+        else:
+            print("Reading source file from path")
+            source_dataset = read_source_file(args.input_file, source_time_frames)
+
+        if args.parquet_cache is not None:
+            print("Writing source file to Parquet cache")
+            write_parquet_cache(source_dataset, args.parquet_cache, source_key)
+            print("Parquet cache written to {}".format(args.parquet_cache))
+
+    return source_dataset
+
+
+"""
+Helper function for the Parquet partition filters that select the event_date partitions of the timeframes
+
+@param time_frames: dict of timeframe label to (start, end) timestamps
+"""
+def event_date_partition_filters(time_frames):
+    # Each inner list is and-ed, the outer list or-s the timeframes together
+    return [
+        [
+            ("event_date", ">=", int(start_date.strftime("%Y%m%d"))),
+            ("event_date", "<=", int(end_date.strftime("%Y%m%d"))),
+        ]
+        for start_date, end_date in time_frames.values()
+    ]
+
+
+"""
+Helper function for the path of the Parquet cache manifest, the leading underscore keeps Parquet readers from reading it as data
+
+@param cache_dir: directory of the partitioned Parquet dataset
+"""
+def parquet_cache_manifest_file(cache_dir):
+    return os.path.join(cache_dir, "_manifest.json")
+
+
+"""
+Function for converting the raw source dataset into a local Parquet cache partitioned by event_date, with a manifest of the
+source it was written from and the days it covers
+
+@param source: raw source dataset as read from the source file, before any type conversion
+@param cache_dir: directory the partitioned Parquet dataset is written to
+@param source_key: fingerprint of the source the dataset was read from
+"""
+def write_parquet_cache(source, cache_dir, source_key):
+    # Remove any previous cache so partitions are not appended to twice
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+
+    source.to_parquet(
+        cache_dir,
+        engine="pyarrow",
+        partition_cols=["event_date"],
+        index=False,
+    )
+    # Written last, so an interrupted write leaves a cache without a manifest that the next run rebuilds
+    write_store_manifest(
+        parquet_cache_manifest_file(cache_dir),
+        store_source_manifest(source_key, pd.to_datetime(source["event_date"], format="%Y%m%d")),
+    )
+
+
+"""
+Function for reading only the event_date partitions of the Parquet cache that fall within the timeframes
+
+@param cache_dir: directory of the partitioned Parquet dataset
+@param time_frames: dict of timeframe label to (start, end) timestamps to be loaded, None reads every partition
+"""
+def read_parquet_cache(cache_dir, time_frames):
+    partition_filters = None
+    if time_frames is not None:
+        partition_filters = event_date_partition_filters(time_frames)
+
+    cached_dataset = pd.read_parquet(
+        cache_dir,
+        engine="pyarrow",
+        columns=source_columns,
+        filters=partition_filters,
+    )
+
+    # Partition keys are read back as a categorical, restore the yyyymmdd integers
+    cached_dataset["event_date"] = cached_dataset["event_date"].astype("int64")
+    cached_dataset[categorical_columns] = cached_dataset[categorical_columns].astype(
+        "category"
+    )
+
+    return cached_dataset[source_columns]
+
+
+"""
+Function for building the URL canonicalization table, cleaning each unique page_url and checking it against the active URLs only once
+
+@param source: the raw source dataset with page_url held as a categorical, whose codes are the URL IDs
+@param active_urls: file with all the 200 status codes URLs
+"""
+def build_url_table(source, active_urls):
+    page_urls = pd.Series(source["page_url"].cat.categories, dtype="object")
+    page_urls_cleaned = (
+        page_urls.str.replace("https://headstart.gov", "", regex=True)
+        .str.split("?")
+        .str[0]
+    )
+    page_paths_one = "/" + page_urls_cleaned.str.split("/").str[1]
+
+    url_table = pd.DataFrame(
+        {
+            "page_url": page_urls,
+            "page_url_cleaned": page_urls_cleaned.astype("category"),
+            "page_path_one": page_paths_one.astype("category"),
+            "is_active": page_urls_cleaned.isin(active_urls["URLs"]),
+        }
+    )
+    url_table.index.name = "page_url_id"
+    return url_table
+
+
+"""
+Helper function for looking up a URL table column for every row by URL ID
+
+@param url_column: categorical column of the URL table
+@param page_url_ids: URL IDs of the rows, -1 where page_url is missing
+"""
+def gather_url_column(url_column, page_url_ids):
+    codes = url_column.cat.codes.to_numpy()[page_url_ids]
+    codes[page_url_ids < 0] = -1
+    return pd.Categorical.from_codes(codes, dtype=url_column.dtype)
+
+
+"""
+Helper function for reading the JSON manifest of a store, None if the store has none
+
+@param manifest_file: path of the manifest
+"""
+def read_store_manifest(manifest_file):
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file) as manifest_json:
+        return json.load(manifest_json)
+
+
+"""
+Helper function for writing the JSON manifest of a store under a temporary name first, so a reader never sees a partial manifest
+
+@param manifest_file: path of the manifest
+@param manifest: JSON serializable manifest
+"""
+def write_store_manifest(manifest_file, manifest):
+    with open(manifest_file + ".tmp", "w") as manifest_json:
+        json.dump(manifest, manifest_json, indent=2)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+"""
+Helper function for the manifest of a store holding every event of the source, the source fingerprint and the days covered
+
+@param source_key: fingerprint of the source the store was written from
+@param event_dates: typed event_date values of the source
+"""
+def store_source_manifest(source_key, event_dates):
+    covered_days = [None, None]
+    if len(event_dates):
+        covered_days = [event_dates.min().strftime("%Y%m%d"), event_dates.max().strftime("%Y%m%d")]
+    return {"source": source_key, "first_day": covered_days[0], "last_day": covered_days[1]}
+
+
+"""
+Helper function for whether a store can be read instead of the source, printing why a store is rebuilt
+The store holds every day of the source, so timeframes past the days it covers have no events in the source either and only
+get a warning
+
+@param store_name: name of the store in the printed messages
+@param store_manifest: manifest of the store, None if the store has none
+@param source_key: fingerprint of the current source
+@param time_frames: dict of timeframe label to (start, end) timestamps to be read, None reads every day
+"""
+def store_source_is_current(store_name, store_manifest, source_key, time_frames):
+    if store_manifest is None:
+        print("The {} has no manifest of the source it was written from, rebuilding it".format(store_name))
+        return False
+    if store_manifest["source"] != source_key:
+        print("The source changed since the {} was written, rebuilding it".format(store_name))
+        return False
+
+    if time_frames is not None and store_manifest["first_day"] is not None:
+        first_day = pd.to_datetime(store_manifest["first_day"], format="%Y%m%d")
+        last_day = pd.to_datetime(store_manifest["last_day"], format="%Y%m%d")
+        for time_frame, (start_date, end_date) in time_frames.items():
+            if start_date < first_day or end_date > last_day:
+                print(
+                    "Warning: the {} timeframe {} to {} is not fully covered by the source, which has events from {} to {}".format(
+                        time_frame,
+                        start_date.strftime("%Y-%m-%d"),
+                        end_date.strftime("%Y-%m-%d"),
+                        first_day.strftime("%Y-%m-%d"),
+                        last_day.strftime("%Y-%m-%d"),
+                    )
+                )
+    return True
+
+
+"""
+Helper function for the manifest of the rollup store, None if the store has none
+The manifest records the active URLs and source the store was built from and every day rolled up, including days without events
+
+@param store_dir: directory of the rollup store
+"""
+def read_rollup_manifest(store_dir):
+    return read_store_manifest(os.path.join(store_dir, "manifest.json"))
+
+
+"""
+Helper function for the days of the timeframes the rollup store needs to roll up: days never rolled up, and once the source
+has changed, the latest days of the previous source, which may have been incomplete when they were rolled up
+
+@param rollup_manifest: manifest of the rollup store, None for an empty store
+@param time_frames: dict of timeframe label to (start, end) timestamps
+@param source_key: fingerprint of the current source
+"""
+def missing_rollup_days(rollup_manifest, time_frames, source_key):
+    time_frame_days = set()
+    for start_date, end_date in time_frames.values():
+        time_frame_days.update(pd.date_range(start_date, end_date))
+    if rollup_manifest is None:
+        return sorted(time_frame_days)
+
+    rolled_up_days = set(pd.to_datetime(rollup_manifest["days"], format="%Y%m%d"))
+    missing_days = time_frame_days - rolled_up_days
+    if rollup_manifest["source"] != source_key and rollup_manifest["last_source_day"] is not None:
+        refresh_from = pd.to_datetime(
+            rollup_manifest["last_source_day"], format="%Y%m%d"
+        ) - pd.DateOffset(days=rollup_refresh_days - 1)
+        missing_days.update(day for day in time_frame_days if day >= refresh_from)
+    return sorted(missing_days)
+
+
+"""
+Function for rolling the active events of the source dataset up to one row per day and URL, plus daily timing histograms
+The timing sums come with counts of the pageviews that have a timing, so averages leave out missing timings
+
+@param source: the typed source dataset
+@param url_table: URL canonicalization table built from the source file and active URLs
+@param quantile_sketch: optional dict of the accuracy and bin_edges of daily quantile sketches, None keeps exact histograms
+"""
+def roll_up_by_day(source, url_table, quantile_sketch=None):
+    cleaned = cleanup_input_raw_results(
+        source[["event_date", "page_url", "page_load_time_ms", "server_response_time_ms"]],
+        url_table,
+    )
+
+    url_rollups = (
+        cleaned.groupby(["event_date", "page_url_cleaned", "page_path_one"], observed=True)
+        .agg(
+            pv=("page_url_cleaned", "count"),
+            plt_sum=("plt_sec", "sum"),
+            plt_count=("plt_sec", "count"),
+            srt_sum=("srt_sec", "sum"),
+            srt_count=("srt_sec", "count"),
+        )
+        .reset_index()
+    )
+
+    latency_rollups = []
+    for metric in ["plt_sec", "srt_sec"]:
+        if quantile_sketch is not None:
+            cleaned[metric] = sketch_values(
+                cleaned[metric], quantile_sketch["accuracy"], quantile_sketch["bin_edges"]
+            )
+        metric_rollups = (
+            cleaned.groupby(["event_date", metric])
+            .size()
+            .rename("count")
+            .reset_index()
+            .rename(columns={metric: "value"})
+        )
+        metric_rollups["metric"] = metric
+        latency_rollups.append(metric_rollups)
+    latency_rollups = pd.concat(latency_rollups, ignore_index=True)
+
+    return url_rollups, latency_rollups
+
+
+"""
+Function for rolling up days of the source dataset into the rollup store, replacing any rollups the store already held for them
+
+@param store_dir: directory of the rollup store
+@param source: the typed source dataset
+@param url_table: URL canonicalization table built from the source file and active URLs
+@param days: days to roll up, days without events are recorded as rolled up too
+@param store_keys: dict with the store version, the active_urls and source fingerprints the days are rolled up from and the
+quantile_sketch the histograms are sketched with
+"""
+def update_rollup_store(store_dir, source, url_table, days, store_keys):
+    day_names = [day.strftime("%Y%m%d") for day in days]
+    for name in ["url_daily", "latency_daily"]:
+        for day_name in day_names:
+            partition_dir = os.path.join(store_dir, name, "event_date={}".format(day_name))
+            if os.path.isdir(partition_dir):
+                shutil.rmtree(partition_dir)
+
+    new_source = source[source["event_date"].isin(days)]
+    if not new_source.empty:
+        for name, rollups in zip(["url_daily", "latency_daily"], roll_up_by_day(new_source, url_table, store_keys["quantile_sketch"])):
+            rollups["event_date"] = rollups["event_date"].dt.strftime("%Y%m%d").astype("int64")
+            rollups.to_parquet(
+                os.path.join(store_dir, name),
+                engine="pyarrow",
+                partition_cols=["event_date"],
+                index=False,
+            )
+
+    rollup_manifest = read_rollup_manifest(store_dir) or {"days": [], "last_source_day": None}
+    source_days = [rollup_manifest["last_source_day"]]
+    if not source.empty:
+        source_days.append(source["event_date"].max().strftime("%Y%m%d"))
+    rollup_manifest.update(
+        store_keys,
+        days=sorted(set(rollup_manifest["days"]) | set(day_names)),
+        last_source_day=max((day for day in source_days if day is not None), default=None),
+    )
+    os.makedirs(store_dir, exist_ok=True)
+    # Written last, so an interrupted update leaves its days to be rolled up again
+    write_store_manifest(os.path.join(store_dir, "manifest.json"), rollup_manifest)
+
+
+"""
+Function for reading the daily rollups of the timeframes from the rollup store
+
+@param store_dir: directory of the rollup store
+@param time_frames: dict of timeframe label to (start, end) timestamps to be loaded
+"""
+def read_rollup_store(store_dir, time_frames):
+    rollups = []
+    for name, columns in [
+        (
+            "url_daily",
+            ["event_date", "page_url_cleaned", "page_path_one", "pv", "plt_sum", "plt_count", "srt_sum", "srt_count"],
+        ),
+        ("latency_daily", ["event_date", "value", "count", "metric"]),
+    ]:
+        # Timeframes whose days all came without events have no partitions to read
+        if not os.path.isdir(os.path.join(store_dir, name)):
+            rollups.append(pd.DataFrame(columns=columns))
+            continue
+        daily_rollups = pd.read_parquet(
+            os.path.join(store_dir, name),
+            engine="pyarrow",
+            filters=event_date_partition_filters(time_frames),
+        )
+        daily_rollups["event_date"] = pd.to_datetime(
+            daily_rollups["event_date"].astype("int64"), format="%Y%m%d"
+        )
+        rollups.append(daily_rollups)
+
+    url_rollups, latency_rollups = rollups
+    url_rollups[["page_url_cleaned", "page_path_one"]] = url_rollups[
+        ["page_url_cleaned", "page_path_one"]
+    ].astype("category")
+    return url_rollups, latency_rollups
+
+
+"""
+Function for combining the daily URL rollups of every timeframe into a grouping by a key
+
+@param url_rollups: daily per URL rollups covering the timeframes
+@param time_frames: dict of timeframe label to (start, end) timestamps
+@param key: column to group by within each timeframe
+@param aggregations: named aggregations combining the daily rollups
+"""
+def group_rollups_by_time_frames(url_rollups, time_frames, key, aggregations):
+    grouped_by_time_frame = {}
+    for time_frame, (start_date, end_date) in time_frames.items():
+        grouped = (
+            url_rollups[url_rollups["event_date"].between(start_date, end_date)]
+            .groupby(key, observed=True)
+            .agg(**aggregations)
+            # Categorical groups come out in the order they were seen, restore the key order
+            .sort_index()
+        )
+        # Groups without any timed pageviews average to NaN, like the mean of their raw events
+        grouped.insert(
+            grouped.columns.get_loc("plt_sum") + 1,
+            "plt_avg",
+            grouped["plt_sum"] / grouped.pop("plt_count").replace(0, np.nan),
+        )
+        grouped["srt_avg"] = grouped["srt_sum"] / grouped.pop("srt_count").replace(0, np.nan)
+        grouped_by_time_frame[time_frame] = grouped.reset_index()
+    return grouped_by_time_frame
+
+
+"""
+Function for the exact sums and counts of the timings of every timeframe from the daily URL rollups, which sketched
+histograms only approximate
+
+@param url_rollups: daily per URL rollups covering the timeframes
+@param time_frames: dict of timeframe label to (start, end) timestamps
+"""
+def timing_totals_from_rollups(url_rollups, time_frames):
+    timing_totals = {}
+    for time_frame, (start_date, end_date) in time_frames.items():
+        time_frame_rollups = url_rollups[url_rollups["event_date"].between(start_date, end_date)]
+        timing_totals[time_frame] = {
+            "plt_sec": (time_frame_rollups["plt_sum"].sum(), time_frame_rollups["plt_count"].sum()),
+            "srt_sec": (time_frame_rollups["srt_sum"].sum(), time_frame_rollups["srt_count"].sum()),
+        }
+    return timing_totals
+
+
+"""
+Function for merging the daily timing histograms of every timeframe
+
+@param latency_rollups: daily timing histograms covering the timeframes
+@param time_frames: dict of timeframe label to (start, end) timestamps
+"""
+def histograms_from_rollups(latency_rollups, time_frames):
+    histograms = {}
+    for time_frame, (start_date, end_date) in time_frames.items():
+        time_frame_rollups = latency_rollups[
+            latency_rollups["event_date"].between(start_date, end_date)
+        ]
+        # A metric whose timings are all missing in the timeframe has no rollups and gets an empty histogram
+        histograms[time_frame] = {
+            metric: time_frame_rollups[time_frame_rollups["metric"] == metric]
+            .groupby("value")["count"]
+            .sum()
+            .sort_index()
+            for metric in ["plt_sec", "srt_sec"]
+        }
+    return histograms
+
 
-    print("Results finalized.")
+"""
+Function for calculating several timeframes in a single pass, tagging each event with the label of its timeframe
 
-    # upload_file = client.folder(config("box_folder_for_uploads")).upload(args.output_file, file_name="results_{start_value}-{end_value}-{datetime_now}.xlsx".format(start_value = args.previous_start_date[0], end_value= args.current_start_date[0], datetime_now = datetime.datetime.now().strftime("%H%M%S")), file_description="Sample Description")
-    program_end_time = datetime.datetime.now()
-    # print("Results uploaded to Box here: https://app.box.com/file/{file_id}".format(file_id = upload_file.id))
-    print(
-        "\nProgram Runtime Duration: {}\n".format(program_end_time - program_start_time)
+@param time_frames: dict of timeframe label to (start, end) timestamps, overlapping timeframes each get their own copy of an event
+@param source: the raw source file
+@param url_table: URL canonicalization table built from the source file and active URLs
+"""
+def calculate_time_frames(time_frames, source, url_table):
+    # Each row is mapped to its distinct event_date once, the timeframes are then checked per day
+    day_codes, event_days = pd.factorize(source["event_date"])
+    event_days = event_days.to_series()
+
+    time_frame_rows = [
+        np.flatnonzero(
+            event_days.between(start_date, end_date, inclusive="both").to_numpy()[day_codes]
+        )
+        for start_date, end_date in time_frames.values()
+    ]
+
+    time_frame_result = source.take(np.concatenate(time_frame_rows))
+    time_frame_result["time_frame"] = pd.Categorical.from_codes(
+        np.repeat(
+            np.arange(len(time_frames)), [len(rows) for rows in time_frame_rows]
+        ),
+        categories=list(time_frames),
     )
+    time_frame_result = time_frame_result.sort_values(
+        ["time_frame", "event_date"], ascending=[True, False]
+    )
+
+    time_frame_result = cleanup_input_raw_results(time_frame_result, url_table)
+
+    return time_frame_result
 
 
 """
-Function for calculating the timeframe based on the start date, timeframe window, and source file
+Helper function for splitting the tagged timeframes into a raw dataframe per timeframe label
 
-@param start_date: string representation of a datetime
-@param window: timeframe lookup (default is two weeks)
-@params source, active_urls: the raw source file and file with all the 200 status codes URLs
-"""
-def calculate_time_frame(start_date, window, source, active_urls):
-    end_date = pd.to_datetime(start_date) + pd.DateOffset(days=window)
-    time_frame_result = source[
-        source["event_date"].between(
-            start_date,
-            end_date,
-            inclusive="both",
+@param time_frame_result: dataframe of events tagged with their timeframe label
+"""
+def split_time_frames(time_frame_result):
+    return {
+        time_frame: raw_results.drop(columns="time_frame").reset_index(drop=True)
+        for time_frame, raw_results in time_frame_result.groupby(
+            "time_frame", observed=True, sort=False
         )
-    ].sort_values("event_date", ascending=False)
+    }
 
-    time_frame_result = cleanup_input_raw_results(time_frame_result, active_urls)
 
-    return time_frame_result
+"""
+Function for writing the raw timeframe datasets for inspection
+Excel files hold one sheet per timeframe, CSV and Parquet files are streamed in chunks with a leading time_frame column
+
+@param raw_results: dict of timeframe label to raw dataframe
+@param output_path: path of the file, its extension picks the format
+@param columns: optional list of the columns to be written, all columns by default
+"""
+def write_raw_datasets(raw_results, output_path, columns=None):
+    if columns is not None:
+        unknown_columns = [
+            column for column in columns if column not in raw_results["current"].columns
+        ]
+        if unknown_columns:
+            raise ValueError(
+                "Unknown raw dataset columns: {}".format(", ".join(unknown_columns))
+            )
+        raw_results = {
+            time_frame: raw_dataset[columns]
+            for time_frame, raw_dataset in raw_results.items()
+        }
+
+    if output_path.endswith(".xlsx"):
+        oversized = [
+            time_frame
+            for time_frame, raw_dataset in raw_results.items()
+            if len(raw_dataset) > excel_max_rows
+        ]
+        if oversized:
+            print(
+                "\nSkipped writing raw datasets to file, the {} timeframe exceeds the Excel row limit. Use a .csv.gz or .parquet path instead\n".format(
+                    " and ".join(oversized)
+                )
+            )
+            return
+
+        with pd.ExcelWriter(output_path) as writer:
+            print("\nWriting datasets to file:")
+            for time_frame, raw_dataset in raw_results.items():
+                raw_dataset.to_excel(
+                    writer,
+                    sheet_name="{}_raw_results".format(time_frame),
+                    index=False,
+                    freeze_panes=(1, 0),
+                )
+                print("{} Raw Results written".format(time_frame.capitalize()))
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    print("\nWriting datasets to file:")
+    parquet_writer = None
+    csv_file = None
+    if output_path.endswith(".csv.gz"):
+        csv_file = gzip.open(output_path, "wt", newline="")
+    elif output_path.endswith(".csv"):
+        csv_file = open(output_path, "w", newline="")
+
+    try:
+        for time_frame, raw_dataset in raw_results.items():
+            for chunk_start in range(0, len(raw_dataset), raw_export_chunk_size):
+                raw_chunk = raw_dataset.iloc[
+                    chunk_start : chunk_start + raw_export_chunk_size
+                ].copy()
+                raw_chunk.insert(0, "time_frame", time_frame)
+                if csv_file is not None:
+                    raw_chunk.to_csv(
+                        csv_file, index=False, header=csv_file.tell() == 0
+                    )
+                else:
+                    raw_table = pa.Table.from_pandas(raw_chunk, preserve_index=False)
+                    if parquet_writer is None:
+                        parquet_writer = pq.ParquetWriter(output_path, raw_table.schema)
+                    parquet_writer.write_table(raw_table.cast(parquet_writer.schema))
+            print("{} Raw Results written".format(time_frame.capitalize()))
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+        if parquet_writer is not None:
+            parquet_writer.close()
 
 
 """
 Helper function for removing non-active URLs from the cleaned dataframe
 
 @param to_clean_dataframe: raw dataframe of a given timeframe
-@param active_urls: the raw source file and file with all the 200 status codes URLs
+@param url_table: URL canonicalization table built from the source file and active URLs
 """
-def cleanup_input_raw_results(to_clean_dataframe, active_urls):
+def cleanup_input_raw_results(to_clean_dataframe, url_table):
     to_clean_dataframe = to_clean_dataframe.rename(
         columns={"page_load_time_ms": "plt_ms", "server_response_time_ms": "srt_ms"}
     )
 
-    to_clean_dataframe["page_url_cleaned"] = to_clean_dataframe["page_url"].replace(
-        "https://headstart.gov", "", regex=True
+    page_url_ids = to_clean_dataframe["page_url"].cat.codes.to_numpy()
+    to_clean_dataframe["page_url_cleaned"] = gather_url_column(
+        url_table["page_url_cleaned"], page_url_ids
     )
-    to_clean_dataframe["page_url_cleaned"] = (
-        to_clean_dataframe["page_url_cleaned"].str.split("?").str[0]
-    )
-    to_clean_dataframe["page_path_one"] = (
-        "/" + to_clean_dataframe["page_url_cleaned"].str.split("/").str[1]
+    to_clean_dataframe["page_path_one"] = gather_url_column(
+        url_table["page_path_one"], page_url_ids
     )
     to_clean_dataframe["plt_sec"] = to_clean_dataframe["plt_ms"] / 1000
     to_clean_dataframe["srt_sec"] = to_clean_dataframe["srt_ms"] / 1000
-    to_clean_dataframe = to_clean_dataframe[
-        to_clean_dataframe["page_url_cleaned"].isin(active_urls["URLs"])
-    ].reset_index()
+    is_active = url_table["is_active"].to_numpy()[page_url_ids] & (page_url_ids >= 0)
+    to_clean_dataframe = to_clean_dataframe[is_active].reset_index()
     return to_clean_dataframe
 
 
 """
-Function for grouping values in the dataframe by the URL
-
-@param to_group_dataframe: dataframe that needs grouping by URL
-"""
-def group_by_page_url(to_group_dataframe):
-    grouped = (
-        to_group_dataframe.sort_values(["page_url_cleaned"], ascending=False)
-        .groupby("page_url_cleaned")
-        .agg(
-            pv=("page_url_cleaned", "count"),
-            plt_sum=("plt_sec", "sum"),
-            plt_avg=("plt_sec", "mean"),
-            srt_sum=("srt_sec", "sum"),
-            srt_avg=("srt_sec", "mean"),
-        )
-        .reset_index()
-    )
-    return grouped
-
-
-"""
-Function for grouping values in the dataframe by the page path
+Function for grouping every timeframe by a key in one grouped pass keyed by (timeframe, key)
 
-@param to_group_dataframe: dataframe that needs grouping by page path
+@param time_frame_result: dataframe of events tagged with their timeframe label
+@param key: column to group by within each timeframe
+@param aggregations: named aggregations of the grouping
 """
-def group_by_page_path(to_group_dateframe):
+def group_by_time_frames(time_frame_result, key, aggregations):
     grouped = (
-        to_group_dateframe.sort_values(["page_path_one"], ascending=False)
-        .groupby("page_path_one")
-        .agg(
-            pages=("page_url_cleaned", "nunique"),
-            pv=("page_path_one", "count"),
-            plt_sum=("plt_sec", "sum"),
-            plt_avg=("plt_sec", "mean"),
-            srt_sum=("srt_sec", "sum"),
-            srt_avg=("srt_sec", "mean"),
-        )
-        .reset_index()
+        time_frame_result.groupby(["time_frame", key], observed=True)
+        .agg(**aggregations)
+        # Categorical groups come out in the order they were seen, restore the key order
+        .sort_index()
     )
-    return grouped
+    return {
+        time_frame: grouped.loc[time_frame].reset_index()
+        for time_frame in time_frame_result["time_frame"].cat.categories
+    }
 
 
 def merge_groups_by_page_url(previous_group, current_group):
@@ -703,13 +2368,19 @@ def merge_groups_by_page_url(previous_group, current_group):
         merged_group["pv_previous"],
         merged_group["pv_current"],
     )
+    merged_group["plt_percent_change"] = per_diff(
+        merged_group["plt_avg_previous"], merged_group["plt_avg_current"]
+    )
+    merged_group["srt_percent_change"] = per_diff(
+        merged_group["srt_avg_previous"], merged_group["srt_avg_current"]
+    )
 
     merged_group = merged_group.reset_index()
 
     return merged_group
 
 
-def create_top_results(previous_raw, previous_group, current_raw, current_group):
+def create_top_results(previous_summary, current_summary):
     print("Calculating Top Level Results")
     metrics = [
         "Total (Pageviews) / Average (Timing):",
@@ -720,136 +2391,39 @@ def create_top_results(previous_raw, previous_group, current_raw, current_group)
         "Max:",
         "Threshold:",
     ]
+    statistics = ["Min", "25th", "50th", "75th", "Max"]
+    pageview_statistics = ["Total"] + statistics
+    timing_statistics = ["Average"] + statistics + ["Threshold"]
 
-    # Calculates the various pageview metrics for the current and previous period
-    current_total_pv = sum(current_group["pv"])
-    current_min_pv = min(current_group["pv"])
-    current_25_quartile_pv = current_group["pv"].quantile(0.25)
-    current_50_quartile_pv = current_group["pv"].quantile(0.50)
-    current_75_quartile_pv = current_group["pv"].quantile(0.75)
-    current_max_pv = max(current_group["pv"])
-
-    previous_total_pv = sum(previous_group["pv"])
-    previous_min_pv = min(previous_group["pv"])
-    previous_25_quartile_pv = previous_group["pv"].quantile(0.25)
-    previous_50_quartile_pv = previous_group["pv"].quantile(0.50)
-    previous_75_quartile_pv = previous_group["pv"].quantile(0.75)
-    previous_max_pv = max(previous_group["pv"])
-
-    # Calculates the various page load time metrics for the current and previous period
-    current_avg_plt = sum(current_raw["plt_sec"]) / sum(current_group["pv"])
-    current_min_plt = min(current_raw["plt_sec"])
-    current_25_quartile_plt = current_raw["plt_sec"].quantile(0.25)
-    current_50_quartile_plt = current_raw["plt_sec"].quantile(0.5)
-    current_75_quartile_plt = current_raw["plt_sec"].quantile(0.75)
-    current_max_plt = max(current_raw["plt_sec"])
-    current_threshold_plt = current_raw["plt_sec"].quantile(0.75) + 1.5 * (
-        current_raw["plt_sec"].quantile(0.75) - current_raw["plt_sec"].quantile(0.25)
-    )
-
-    previous_avg_plt = sum(previous_raw["plt_sec"]) / sum(previous_group["pv"])
-    previous_min_plt = min(previous_raw["plt_sec"])
-    previous_25_quartile_plt = previous_raw["plt_sec"].quantile(0.25)
-    previous_50_quartile_plt = previous_raw["plt_sec"].quantile(0.5)
-    previous_75_quartile_plt = previous_raw["plt_sec"].quantile(0.75)
-    previous_max_plt = max(previous_raw["plt_sec"])
-    previous_threshold_plt = previous_raw["plt_sec"].quantile(0.75) + 1.5 * (
-        previous_raw["plt_sec"].quantile(0.75) - previous_raw["plt_sec"].quantile(0.25)
-    )
-
-    # Calculates the various server response time metrics for the current and previous period
-    current_avg_srt = sum(current_raw["srt_sec"]) / sum(current_group["pv"])
-    current_min_srt = min(current_raw["srt_sec"])
-    current_25_quartile_srt = current_raw["srt_sec"].quantile(0.25)
-    current_50_quartile_srt = current_raw["srt_sec"].quantile(0.5)
-    current_75_quartile_srt = current_raw["srt_sec"].quantile(0.75)
-    current_max_srt = max(current_raw["srt_sec"])
-    current_threshold_srt = current_raw["srt_sec"].quantile(0.75) + 1.5 * (
-        current_raw["srt_sec"].quantile(0.75) - current_raw["srt_sec"].quantile(0.25)
-    )
-
-    previous_avg_srt = sum(previous_raw["srt_sec"]) / sum(previous_group["pv"])
-    previous_min_srt = min(previous_raw["srt_sec"])
-    previous_25_quartile_srt = previous_raw["srt_sec"].quantile(0.25)
-    previous_50_quartile_srt = previous_raw["srt_sec"].quantile(0.5)
-    previous_75_quartile_srt = previous_raw["srt_sec"].quantile(0.75)
-    previous_max_srt = max(previous_raw["srt_sec"])
-    previous_threshold_srt = previous_raw["srt_sec"].quantile(0.75) + 1.5 * (
-        previous_raw["srt_sec"].quantile(0.75) - previous_raw["srt_sec"].quantile(0.25)
-    )
-    # Creates the pageview values column using the calculated pageview metrics
-    current_page_values = [
-        current_total_pv,
-        current_min_pv,
-        current_25_quartile_pv,
-        current_50_quartile_pv,
-        current_75_quartile_pv,
-        current_max_pv,
-        "N/A",
-    ]
-
-    # Creates the percent change column for pageviews
+    # Creates the pageview values and percent change columns from the pageview summaries
+    current_page_values = list(current_summary.loc[pageview_statistics, "pv"]) + ["N/A"]
     percent_change_pv = [
-        per_diff(previous_total_pv, current_total_pv),
-        per_diff(previous_min_pv, current_min_pv),
-        per_diff(previous_25_quartile_pv, current_25_quartile_pv),
-        per_diff(previous_50_quartile_pv, current_50_quartile_pv),
-        per_diff(previous_75_quartile_pv, current_75_quartile_pv),
-        per_diff(previous_max_pv, current_max_pv),
-        "N/A",
-    ]
-
-    # Creates the load time values column using the calculated load time metrics
-    current_page_load_time_values = [
-        current_avg_plt,
-        current_min_plt,
-        current_25_quartile_plt,
-        current_50_quartile_plt,
-        current_75_quartile_plt,
-        current_max_plt,
-        current_threshold_plt,
-    ]
+        per_diff(previous_summary.at[statistic, "pv"], current_summary.at[statistic, "pv"])
+        for statistic in pageview_statistics
+    ] + ["N/A"]
 
-    # Creates the percent change column for page load time
+    # Creates the load time values and percent change columns from the page load time summaries
+    current_page_load_time_values = list(
+        current_summary.loc[timing_statistics, "plt_sec"]
+    )
     percent_change_plt_sec = [
-        per_diff(previous_avg_plt, current_avg_plt),
-        per_diff(previous_min_plt, current_min_plt),
-        per_diff(previous_25_quartile_plt, current_25_quartile_plt),
-        per_diff(previous_50_quartile_plt, current_50_quartile_plt),
-        per_diff(previous_75_quartile_plt, current_75_quartile_plt),
-        per_diff(previous_max_plt, current_max_plt),
-        per_diff(previous_threshold_plt, current_threshold_plt),
-    ]
-
-    # Creates the server response values column using the calculated server response metrics
-    current_server_response_time_values = [
-        current_avg_srt,
-        current_min_srt,
-        current_25_quartile_srt,
-        current_50_quartile_srt,
-        current_75_quartile_srt,
-        current_max_srt,
-        current_threshold_srt,
+        per_diff(
+            previous_summary.at[statistic, "plt_sec"],
+            current_summary.at[statistic, "plt_sec"],
+        )
+        for statistic in timing_statistics
     ]
 
-    # Creates the percent change column for server response time
+    # Creates the server response values and percent change columns from the server response time summaries
+    current_server_response_time_values = list(
+        current_summary.loc[timing_statistics, "srt_sec"]
+    )
     percent_change_srt_sec = [
-        per_diff(previous_avg_srt, current_avg_srt),
-        per_diff(previous_min_srt, current_min_srt),
-        per_diff(
-            previous_25_quartile_srt,
-            current_25_quartile_srt,
-        ),
-        per_diff(
-            previous_50_quartile_srt,
-            current_50_quartile_srt,
-        ),
         per_diff(
-            previous_75_quartile_srt,
-            current_75_quartile_srt,
-        ),
-        per_diff(previous_max_srt, current_max_srt),
-        per_diff(previous_threshold_srt, current_threshold_srt),
+            previous_summary.at[statistic, "srt_sec"],
+            current_summary.at[statistic, "srt_sec"],
+        )
+        for statistic in timing_statistics
     ]
 
     # Combine all the metrics and values into a new DataFrame for top_level_summary
@@ -865,90 +2439,45 @@ def create_top_results(previous_raw, previous_group, current_raw, current_group)
         }
     )
 
+    # Summaries merged from quantile sketches carry the error bound of each timing statistic
+    if "plt_sec_error" in current_summary.columns:
+        top_level.insert(
+            top_level.columns.get_loc("Page Load Times (sec)") + 1,
+            "Page Load Time Error Bound (sec)",
+            list(current_summary.loc[timing_statistics, "plt_sec_error"]),
+        )
+        top_level.insert(
+            top_level.columns.get_loc("Server Response Times (sec)") + 1,
+            "Server Response Time Error Bound (sec)",
+            list(current_summary.loc[timing_statistics, "srt_sec_error"]),
+        )
+
     return top_level
 
 
-def create_external_metrics(current_raw, current_group):
+def create_external_metrics(current_histogram, current_group, metric, bin_edges):
     print("Calculating External Metrics Results")
-    external_metrics = [
-        "90 secs:",
-        ">30 - <90 secs:",
-        ">10 - <=30 secs:",
-        ">5 - <=10 secs:",
-        ">2.9 - <=5 secs:",
-        ">1.7 - <=2.9 secs:",
-        ">0.8 - <=1.7 secs:",
-        "<= 0.8 secs:",
+    # Buckets are listed from the slowest to the fastest
+    url_counts = bin_counts(current_group[metric + "_avg"], bin_edges)[::-1]
+    pageview_counts = bin_counts(
+        current_histogram.index, bin_edges, weights=current_histogram.to_numpy()
+    )[::-1]
+    total_page_urls = current_group["page_url_cleaned"].count()
+    # Pageviews with a missing timing are left out of the buckets but still count toward the total
+    total_pageviews = current_group["pv"].sum()
+
+    external_metrics = bin_labels(bin_edges)[::-1] + [
         "WA: {:0.2f} secs".format(
             weighted_avg(
-                current_group["plt_avg"],
+                current_group[metric + "_avg"],
                 current_group["pv"],
             )
         ),
     ]
-
-    page_url_counts = [
-        current_group["plt_avg"].ge(90).sum(),
-        (current_group["plt_avg"].lt(90) & current_group["plt_avg"].gt(30)).sum(),
-        (current_group["plt_avg"].le(30) & current_group["plt_avg"].gt(10)).sum(),
-        (current_group["plt_avg"].le(10) & current_group["plt_avg"].gt(5)).sum(),
-        (current_group["plt_avg"].le(5) & current_group["plt_avg"].gt(2.9)).sum(),
-        (current_group["plt_avg"].le(2.9) & current_group["plt_avg"].gt(1.7)).sum(),
-        (current_group["plt_avg"].le(1.7) & current_group["plt_avg"].gt(0.8)).sum(),
-        current_group["plt_avg"].le(0.8).sum(),
-        current_group["page_url_cleaned"].count(),
-    ]
-
-    percent_urls = [
-        current_group["plt_avg"].ge(90).sum()
-        / current_group["page_url_cleaned"].count(),
-        (current_group["plt_avg"].lt(90) & current_group["plt_avg"].gt(30)).sum()
-        / current_group["page_url_cleaned"].count(),
-        (current_group["plt_avg"].le(30) & current_group["plt_avg"].gt(10)).sum()
-        / current_group["page_url_cleaned"].count(),
-        (current_group["plt_avg"].le(10) & current_group["plt_avg"].gt(5)).sum()
-        / current_group["page_url_cleaned"].count(),
-        (current_group["plt_avg"].le(5) & current_group["plt_avg"].gt(2.9)).sum()
-        / current_group["page_url_cleaned"].count(),
-        (current_group["plt_avg"].le(2.9) & current_group["plt_avg"].gt(1.7)).sum()
-        / current_group["page_url_cleaned"].count(),
-        (current_group["plt_avg"].le(1.7) & current_group["plt_avg"].gt(0.8)).sum()
-        / current_group["page_url_cleaned"].count(),
-        current_group["plt_avg"].le(0.8).sum()
-        / current_group["page_url_cleaned"].count(),
-        current_group["page_url_cleaned"].count()
-        / current_group["page_url_cleaned"].count(),
-    ]
-
-    pageview_counts = [
-        current_raw["plt_sec"].ge(90).sum(),
-        (current_raw["plt_sec"].lt(90) & current_raw["plt_sec"].gt(30)).sum(),
-        (current_raw["plt_sec"].le(30) & current_raw["plt_sec"].gt(10)).sum(),
-        (current_raw["plt_sec"].le(10) & current_raw["plt_sec"].gt(5)).sum(),
-        (current_raw["plt_sec"].le(5) & current_raw["plt_sec"].gt(2.9)).sum(),
-        (current_raw["plt_sec"].le(2.9) & current_raw["plt_sec"].gt(1.7)).sum(),
-        (current_raw["plt_sec"].le(1.7) & current_raw["plt_sec"].gt(0.8)).sum(),
-        current_raw["plt_sec"].le(0.8).sum(),
-        current_raw["page_url"].count(),
-    ]
-
-    percent_pages = [
-        current_raw["plt_sec"].ge(90).sum() / current_raw["page_url"].count(),
-        (current_raw["plt_sec"].lt(90) & current_raw["plt_sec"].gt(30)).sum()
-        / current_raw["page_url"].count(),
-        (current_raw["plt_sec"].le(30) & current_raw["plt_sec"].gt(10)).sum()
-        / current_raw["page_url"].count(),
-        (current_raw["plt_sec"].le(10) & current_raw["plt_sec"].gt(5)).sum()
-        / current_raw["page_url"].count(),
-        (current_raw["plt_sec"].le(5) & current_raw["plt_sec"].gt(2.9)).sum()
-        / current_raw["page_url"].count(),
-        (current_raw["plt_sec"].le(2.9) & current_raw["plt_sec"].gt(1.7)).sum()
-        / current_raw["page_url"].count(),
-        (current_raw["plt_sec"].le(1.7) & current_raw["plt_sec"].gt(0.8)).sum()
-        / current_raw["page_url"].count(),
-        current_raw["plt_sec"].le(0.8).sum() / current_raw["page_url"].count(),
-        current_raw["page_url"].count() / current_raw["page_url"].count(),
-    ]
+    page_url_counts = list(url_counts) + [total_page_urls]
+    percent_urls = [count / total_page_urls for count in page_url_counts]
+    pageview_counts = list(pageview_counts.astype("int64")) + [total_pageviews]
+    percent_pages = [count / total_pageviews for count in pageview_counts]
 
     external_results = pd.DataFrame(
         {
@@ -964,7 +2493,7 @@ def create_external_metrics(current_raw, current_group):
 
 
 def create_grouped_by_page_path(previous_group, current_group):
-    grouped_result = current_group
+    grouped_result = current_group.copy()
     grouped_result["pv_percent_of_total"] = (
         current_group["pv"] / current_group["pv"].sum()
     )
@@ -1017,57 +2546,70 @@ def create_top_pageview_changes(merged_group):
     return pageview_changes
 
 
-def create_change_outliers(merged_group):
-    print("Calculating Change Outliers Results")
-    outliers = merged_group
+"""
+Helper function for classifying each result as non-outlier, PLT outlier, SRT outlier, or both types of outlier
+Results that none of the comparisons match, such as missing timings, are left as NaN
 
-    outliers["plt_percent_change"] = per_diff(
-        outliers["plt_avg_previous"], outliers["plt_avg_current"]
+@param plt_values: page load time values of the results
+@param srt_values: server response time values of the results
+@param plt_threshold: page load time value from which a result is an outlier
+@param srt_threshold: server response time value from which a result is an outlier
+"""
+def classify_outliers(plt_values, srt_values, plt_threshold, srt_threshold):
+    outlier_values = pd.Series(np.nan, index=plt_values.index, dtype=object)
+    outlier_values[(plt_values >= plt_threshold) & (srt_values >= srt_threshold)] = (
+        "PLT and SRT"
     )
-    outliers["srt_percent_change"] = per_diff(
-        outliers["srt_avg_previous"], outliers["srt_avg_current"]
+    outlier_values[(plt_values > plt_threshold) & (srt_values < srt_threshold)] = "PLT"
+    outlier_values[(plt_values < plt_threshold) & (srt_values >= srt_threshold)] = "SRT"
+    outlier_values[(plt_values < plt_threshold) & (srt_values < srt_threshold)] = "N/A"
+    return outlier_values
+
+
+"""
+Helper function for the outlier type of each URL by its timing percent changes, with the thresholds taken from the interquartile range of the changes
+
+@param merged_group: previous and current timeframes grouped by URL and merged
+"""
+def change_outlier_values(merged_group):
+    thresholds = [
+        merged_group[column].quantile(0.75)
+        + 1.5 * (merged_group[column].quantile(0.75) - merged_group[column].quantile(0.25))
+        for column in ["plt_percent_change", "srt_percent_change"]
+    ]
+    return classify_outliers(
+        merged_group["plt_percent_change"], merged_group["srt_percent_change"], *thresholds
     )
-    current_threshold_plt_percent_change = outliers["plt_percent_change"].quantile(
-        0.75
-    ) + 1.5 * (
-        outliers["plt_percent_change"].quantile(0.75)
-        - outliers["plt_percent_change"].quantile(0.25)
+
+
+"""
+Helper function for the outlier type of each URL by its current timings, with the thresholds of the current timeframe summary
+
+@param current_summary: distribution summary of the current timeframe
+@param merged_group: previous and current timeframes grouped by URL and merged
+"""
+def current_outlier_values(current_summary, merged_group):
+    return classify_outliers(
+        merged_group["plt_avg_current"],
+        merged_group["srt_avg_current"],
+        current_summary.at["Threshold", "plt_sec"],
+        current_summary.at["Threshold", "srt_sec"],
     )
-    current_threshold_srt_percent_change = outliers["srt_percent_change"].quantile(
-        0.75
-    ) + 1.5 * (
-        outliers["srt_percent_change"].quantile(0.75)
-        - outliers["srt_percent_change"].quantile(0.25)
+
+
+def create_grouped_by_page_url(current_summary, merged_group):
+    print("Calculating Grouped by Page URL Results")
+    # URLs the current thresholds leave unclassified keep the type of their timing changes
+    return merged_group.assign(
+        outlier_value=current_outlier_values(current_summary, merged_group).fillna(
+            change_outlier_values(merged_group)
+        )
     )
-    # Classify each result as non-outlier, PLT outlier, SRT outlier, or both types of outlier
-    outliers.loc[
-        (
-            (outliers["plt_percent_change"] >= current_threshold_plt_percent_change)
-            & (outliers["srt_percent_change"] >= current_threshold_srt_percent_change)
-        ),
-        "outlier_value",
-    ] = "PLT and SRT"
-    outliers.loc[
-        (
-            (outliers["plt_percent_change"] > current_threshold_plt_percent_change)
-            & (outliers["srt_percent_change"] < current_threshold_srt_percent_change)
-        ),
-        "outlier_value",
-    ] = "PLT"
-    outliers.loc[
-        (
-            (outliers["plt_percent_change"] < current_threshold_plt_percent_change)
-            & (outliers["srt_percent_change"] >= current_threshold_srt_percent_change)
-        ),
-        "outlier_value",
-    ] = "SRT"
-    outliers.loc[
-        (
-            (outliers["plt_percent_change"] < current_threshold_plt_percent_change)
-            & (outliers["srt_percent_change"] < current_threshold_srt_percent_change)
-        ),
-        "outlier_value",
-    ] = "N/A"
+
+
+def create_change_outliers(merged_group):
+    print("Calculating Change Outliers Results")
+    outliers = merged_group.assign(outlier_value=change_outlier_values(merged_group))
 
     # Drop results that are not an outlier type
     outliers = outliers[
@@ -1096,48 +2638,17 @@ def create_change_outliers(merged_group):
     return outliers
 
 
-def create_current_outliers(current_raw, merged_group):
+def create_current_outliers(current_summary, merged_group):
     print("Calculating Current Outliers Results")
-    outliers = merged_group
-    current_threshold_plt = current_raw["plt_sec"].quantile(0.75) + 1.5 * (
-        current_raw["plt_sec"].quantile(0.75) - current_raw["plt_sec"].quantile(0.25)
-    )
-    current_threshold_srt = current_raw["srt_sec"].quantile(0.75) + 1.5 * (
-        current_raw["srt_sec"].quantile(0.75) - current_raw["srt_sec"].quantile(0.25)
-    )
-    outliers.loc[
-        (outliers["plt_avg_current"] >= current_threshold_plt)
-        & (outliers["srt_avg_current"] >= current_threshold_srt),
-        "outlier_value",
-    ] = "PLT and SRT"
-    outliers.loc[
-        (outliers["plt_avg_current"] > current_threshold_plt)
-        & (outliers["srt_avg_current"] < current_threshold_srt),
-        "outlier_value",
-    ] = "PLT"
-    outliers.loc[
-        (outliers["plt_avg_current"] < current_threshold_plt)
-        & (outliers["srt_avg_current"] >= current_threshold_srt),
-        "outlier_value",
-    ] = "SRT"
-    outliers.loc[
-        (outliers["plt_avg_current"] < current_threshold_plt)
-        & (outliers["srt_avg_current"] < current_threshold_srt),
-        "outlier_value",
-    ] = "N/A"
+    outliers = merged_group.assign(
+        outlier_value=current_outlier_values(current_summary, merged_group)
+    )
 
     # Drop results that are not an outlier type
     outliers = outliers[
         outliers["outlier_value"].isin(["PLT", "PLT and SRT", "SRT"])
     ].reset_index()
 
-    outliers["plt_percent_change"] = per_diff(
-        outliers["plt_avg_previous"], outliers["plt_avg_current"]
-    )
-    outliers["srt_percent_change"] = per_diff(
-        outliers["srt_avg_previous"], outliers["srt_avg_current"]
-    )
-
     # Drop unneeded columns
     outliers = outliers[
         [
@@ -1161,6 +2672,8 @@ def create_current_outliers(current_raw, merged_group):
 
 
 def style_header_row(input):
+    from styleframe import Styler, utils
+
     input.apply_headers_style(
         styler_obj=Styler(
             border_type=utils.borders.double,
@@ -1171,5 +2684,570 @@ def style_header_row(input):
     )
 
 
+"""
+Helper function for the columns of a results sheet that each column format applies to
+
+@param results_frame: dataframe of the results sheet
+@param sheet_name: name of the results sheet in report_sheets
+"""
+def sheet_column_formats(results_frame, sheet_name):
+    for columns, number_format, horizontal_alignment in report_sheets[sheet_name][
+        "column_formats"
+    ]:
+        if columns is None:
+            columns = list(results_frame.columns)
+        else:
+            columns = [column for column in columns if column in results_frame.columns]
+        yield columns, number_format, horizontal_alignment
+
+
+"""
+Function for styling a results sheet through StyleFrame
+
+@param results_frame: dataframe of the results sheet
+@param sheet_name: name of the results sheet in report_sheets
+"""
+def style_results_sheet(results_frame, sheet_name):
+    from styleframe import StyleFrame, Styler
+
+    styled_results = StyleFrame(results_frame)
+    style_header_row(styled_results)
+    for columns, number_format, horizontal_alignment in sheet_column_formats(
+        results_frame, sheet_name
+    ):
+        styled_results.apply_column_style(
+            cols_to_style=columns,
+            styler_obj=Styler(
+                number_format=number_format,
+                horizontal_alignment=horizontal_alignment,
+            ),
+        )
+    return styled_results
+
+
+"""
+Function for writing the results to a workbook styled through StyleFrame
+
+@param results: dict of results sheet name to dataframe, in workbook order
+@param output_file: path of the workbook
+@param workers: number of threads the sheets are styled on
+"""
+def write_styled_workbook(results, output_file, workers=1):
+    from styleframe import StyleFrame
+
+    styled_sheets = run_concurrently(
+        {
+            sheet_name: (
+                run_stage,
+                ("style_" + sheet_name, style_results_sheet, results_frame, sheet_name),
+            )
+            for sheet_name, results_frame in results.items()
+        },
+        workers,
+    )
+    with instrument_stage("write_workbook", rows_in=count_rows(results)):
+        with StyleFrame.ExcelWriter(output_file) as writer:
+            print("\nWriting results to file:")
+            for sheet_name, results_frame in results.items():
+                styled_results = styled_sheets[sheet_name]
+                with instrument_stage("write_" + sheet_name, rows_in=len(results_frame)):
+                    styled_results.to_excel(
+                        writer,
+                        sheet_name=sheet_name,
+                        index=False,
+                        freeze_panes=(1, 0),
+                        row_to_add_filters=0,
+                        best_fit=list(styled_results.columns),
+                    )
+                    if report_sheets[sheet_name].get("highlight_outliers"):
+                        add_outlier_rule(writer.sheets[sheet_name], results_frame)
+                print("{} Results written".format(report_sheets[sheet_name]["title"]))
+
+
+"""
+Helper function for highlighting the outlier rows of a results sheet with one conditional formatting rule
+
+@param worksheet: openpyxl worksheet the results sheet is written to
+@param results_frame: dataframe of the results sheet
+"""
+def add_outlier_rule(worksheet, results_frame):
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    if results_frame.empty:
+        return
+    last_column = get_column_letter(len(results_frame.columns))
+    outlier_column = get_column_letter(
+        results_frame.columns.get_loc("outlier_value") + 1
+    )
+    worksheet.conditional_formatting.add(
+        "A2:{}{}".format(last_column, len(results_frame) + 1),
+        FormulaRule(
+            formula=['${}2<>"N/A"'.format(outlier_column)],
+            font=Font(bold=True),
+            fill=PatternFill("solid", bgColor=outlier_bg_color),
+        ),
+    )
+
+
+"""
+Helper function for a named cell style of the streaming workbook, registering it on first use
+
+@param workbook: write-only workbook the style is registered with
+@param number_format: number format of the cells
+@param horizontal_alignment: horizontal alignment of the cells
+"""
+def streaming_cell_style(workbook, number_format, horizontal_alignment):
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
+
+    style_name = "results_{}_{}".format(number_format, horizontal_alignment)
+    if style_name not in workbook.named_styles:
+        side = Side(border_style="thin", color="000000")
+        cell_style = NamedStyle(
+            name=style_name,
+            font=Font(name="Arial", size=12),
+            alignment=Alignment(horizontal=horizontal_alignment, vertical="center"),
+            border=Border(left=side, right=side, top=side, bottom=side),
+            number_format=number_format,
+        )
+        workbook.add_named_style(cell_style)
+    return style_name
+
+
+"""
+Function for writing the results to a write-only workbook that streams rows in order with one style per column
+
+@param results: dict of results sheet name to dataframe, in workbook order
+@param output_file: path of the workbook
+"""
+def write_streaming_workbook(results, output_file):
+    from openpyxl import Workbook
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+
+    workbook = Workbook(write_only=True)
+
+    header_side = Side(border_style="double", color="000000")
+    workbook.add_named_style(
+        NamedStyle(
+            name="results_header",
+            font=Font(name="Arial", size=12, bold=True, color="FFFFFF"),
+            fill=PatternFill("solid", fgColor="336A90"),
+            alignment=Alignment(
+                horizontal="center", vertical="center", wrap_text=True, shrink_to_fit=True
+            ),
+            border=Border(left=header_side, right=header_side, top=header_side, bottom=header_side),
+        )
+    )
+
+    print("\nWriting results to file:")
+    for sheet_name, results_frame in results.items():
+        run_stage(
+            "write_" + sheet_name, write_streaming_sheet, workbook, sheet_name, results_frame
+        )
+        print("{} Results written".format(report_sheets[sheet_name]["title"]))
+
+    with instrument_stage("save_workbook"):
+        workbook.save(output_file)
+
+
+"""
+Function for streaming one results sheet into the write-only workbook
+
+@param workbook: write-only workbook the sheet is added to
+@param sheet_name: name of the results sheet in report_sheets
+@param results_frame: dataframe of the results sheet
+"""
+def write_streaming_sheet(workbook, sheet_name, results_frame):
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    worksheet = workbook.create_sheet(sheet_name)
+    columns = list(results_frame.columns)
+
+    # Column styles default to the centered general format of StyleFrame
+    column_styles = {column: ("General", "center") for column in columns}
+    for styled_columns, number_format, horizontal_alignment in sheet_column_formats(
+        results_frame, sheet_name
+    ):
+        for column in styled_columns:
+            column_styles[column] = (number_format, horizontal_alignment)
+    row_styles = [
+        streaming_cell_style(workbook, *column_styles[column]) for column in columns
+    ]
+
+    # Widths follow the best fit of StyleFrame and must be set before any row is streamed
+    for column_index, column in enumerate(columns, start=1):
+        longest_value = results_frame[column].astype(str).str.len().max()
+        if pd.isna(longest_value):
+            longest_value = 0
+        worksheet.column_dimensions[get_column_letter(column_index)].width = (
+            longest_value + 13
+        ) * 1.3
+    worksheet.freeze_panes = "A2"
+    worksheet.auto_filter.ref = "A1:{}1".format(get_column_letter(len(columns)))
+    if report_sheets[sheet_name].get("highlight_outliers"):
+        add_outlier_rule(worksheet, results_frame)
+
+    header_cells = []
+    for column in columns:
+        header_cell = WriteOnlyCell(worksheet, value=column)
+        header_cell.style = "results_header"
+        header_cells.append(header_cell)
+    worksheet.append(header_cells)
+
+    for row_values in results_frame.itertuples(index=False, name=None):
+        row_cells = []
+        for value, style_name in zip(row_values, row_styles):
+            # Missing values are written as empty cells like StyleFrame does
+            if isinstance(value, float) and np.isnan(value):
+                value = None
+            row_cell = WriteOnlyCell(worksheet, value=value)
+            row_cell.style = style_name
+            row_cells.append(row_cell)
+        worksheet.append(row_cells)
+
+
+"""
+Helper function for the Parquet type of an object column of the results
+Numbers padded with "N/A" placeholders, such as the Pages column of the top level summary, keep their numeric type with nulls
+in place of the placeholders, while text columns such as outlier_value are stored as strings
+
+@param column: object column of a results dataframe
+"""
+def parquet_column(column):
+    try:
+        return pd.to_numeric(column.mask(column.eq("N/A")))
+    except (TypeError, ValueError):
+        return column.map(lambda value: value if pd.isna(value) else str(value))
+
+
+"""
+Function for writing the results as a directory of unstyled Parquet, CSV or JSON files with a manifest.json describing them
+
+@param results: dict of results sheet name to dataframe, in workbook order
+@param output_dir: directory the results files and manifest are written to
+@param output_format: file format of the results, one of parquet, csv or json
+@param time_frames: dict of timeframe label to (start, end) timestamps of the results
+"""
+def write_results_bundle(results, output_dir, output_format, time_frames):
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = {
+        "format": output_format,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "time_frames": {
+            time_frame: {
+                "start": start_date.strftime("%Y-%m-%d"),
+                "end": end_date.strftime("%Y-%m-%d"),
+            }
+            for time_frame, (start_date, end_date) in time_frames.items()
+        },
+        "results": [],
+    }
+
+    print("\nWriting results to directory:")
+    for sheet_name, results_frame in results.items():
+        file_name = "{}.{}".format(sheet_name, output_format)
+        file_path = os.path.join(output_dir, file_name)
+        with instrument_stage("write_" + sheet_name, rows_in=len(results_frame)):
+            if output_format == "parquet":
+                parquet_frame = results_frame.copy()
+                for column in parquet_frame.columns[parquet_frame.dtypes == object]:
+                    parquet_frame[column] = parquet_column(parquet_frame[column])
+                parquet_frame.to_parquet(file_path, engine="pyarrow", index=False)
+            elif output_format == "csv":
+                results_frame.to_csv(file_path, index=False)
+            else:
+                results_frame.to_json(file_path, orient="records", date_format="iso")
+
+        manifest["results"].append(
+            {
+                "name": sheet_name,
+                "file": file_name,
+                "rows": len(results_frame),
+                "columns": [str(column) for column in results_frame.columns],
+            }
+        )
+        print("{} Results written".format(report_sheets[sheet_name]["title"]))
+
+    with open(os.path.join(output_dir, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+"""
+Helper function for the SHA-256 of a local file's contents, remembered in the cache directory by the file's size and
+modification time so unchanged inputs are not read again
+
+@param file_path: path of the local file
+@param cache_dir: directory of the result cache
+"""
+def file_fingerprint(file_path, cache_dir):
+    file_path = os.path.abspath(file_path)
+    file_stat = os.stat(file_path)
+    fingerprints_file = os.path.join(cache_dir, "file_fingerprints.json")
+
+    fingerprints = {}
+    if os.path.isfile(fingerprints_file):
+        with open(fingerprints_file) as fingerprints_json:
+            fingerprints = json.load(fingerprints_json)
+    remembered = fingerprints.get(file_path)
+    if remembered is not None and remembered["stat"] == [file_stat.st_size, file_stat.st_mtime_ns]:
+        return remembered["sha256"]
+
+    content_hash = hashlib.sha256()
+    with open(file_path, "rb") as input_file:
+        for block in iter(lambda: input_file.read(fingerprint_block_size), b""):
+            content_hash.update(block)
+
+    fingerprints[file_path] = {
+        "stat": [file_stat.st_size, file_stat.st_mtime_ns],
+        "sha256": content_hash.hexdigest(),
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(fingerprints_file + ".tmp", "w") as fingerprints_json:
+        json.dump(fingerprints, fingerprints_json, indent=2)
+    os.replace(fingerprints_file + ".tmp", fingerprints_file)
+    return content_hash.hexdigest()
+
+
+"""
+Helper function for the fingerprint of a GCS file, taken from its object metadata so the file is not downloaded
+
+@param gcs_path: gs:// path of the file
+"""
+def gcs_fingerprint(gcs_path):
+    import fsspec
+
+    file_system, file_path = fsspec.core.url_to_fs(gcs_path, token=load_credentials())
+    return file_system.ukey(file_path)
+
+
+"""
+Helper function for the fingerprint of the BigQuery source table, taken from its last modified time and row count
+
+@param table: fully qualified name of the table
+"""
+def bigquery_fingerprint(table):
+    from google.cloud import bigquery
+
+    credentials = load_credentials()
+    bq_client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+    source_table = bq_client.get_table(table)
+    return "{}:{}".format(source_table.modified.isoformat(), source_table.num_rows)
+
+
+"""
+Helper function for the fingerprint of the source the run reads, from the metadata of the BigQuery table or GCS file,
+or from the contents of a local input file when a directory to remember them in is given
+
+@param args: parsed command line arguments
+@param fingerprint_dir: optional directory the content hashes of local files are remembered in
+"""
+def source_fingerprint(args, fingerprint_dir=None):
+    if args.source_reader == "bigquery":
+        return bigquery_fingerprint(bq_table)
+    if args.input_file is None:
+        return gcs_fingerprint(bucket_location_for_raw_data)
+    if fingerprint_dir is not None:
+        return file_fingerprint(args.input_file.name, fingerprint_dir)
+    input_stat = os.stat(args.input_file.name)
+    return "{}:{}:{}".format(os.path.abspath(args.input_file.name), input_stat.st_size, input_stat.st_mtime_ns)
+
+
+"""
+Helper function for the fingerprint of the active URLs list, independent of the order of the URLs
+
+@param active_urls: dataframe of the active URLs
+"""
+def active_urls_fingerprint(active_urls):
+    urls = sorted(active_urls["URLs"].dropna().astype(str).unique())
+    return hashlib.sha256("\n".join(urls).encode()).hexdigest()
+
+
+"""
+Helper function for whether a run reads its source through the Parquet cache, Arrow store or rollup store
+
+@param args: parsed command line arguments
+"""
+def store_in_use(args):
+    return any(store is not None for store in [args.parquet_cache, args.arrow_store, args.rollup_store])
+
+
+"""
+Helper function for the source fingerprint recorded in the manifest of every store the run uses, None for a store without one
+
+@param args: parsed command line arguments
+"""
+def store_sources(args):
+    manifest_files = {}
+    if args.parquet_cache is not None:
+        manifest_files["Parquet cache"] = parquet_cache_manifest_file(args.parquet_cache)
+    if args.arrow_store is not None:
+        manifest_files["Arrow store"] = arrow_store_manifest_file(args.arrow_store)
+    if args.rollup_store is not None:
+        manifest_files["rollup store"] = os.path.join(args.rollup_store, "manifest.json")
+
+    sources = {}
+    for store_name, manifest_file in manifest_files.items():
+        store_manifest = read_store_manifest(manifest_file)
+        sources[store_name] = store_manifest["source"] if store_manifest is not None else None
+    return sources
+
+
+"""
+Helper function for the fingerprint of a store, from the size and modified time of every file in it, None if no store is
+specified. A run reads the store rather than the source, so a store built from older data changes the results
+
+@param store_path: path of the store file or directory
+"""
+def store_fingerprint(store_path):
+    if store_path is None:
+        return None
+    if os.path.isfile(store_path):
+        store_files = [store_path]
+    else:
+        store_files = sorted(
+            os.path.join(directory, file_name)
+            for directory, _, file_names in os.walk(store_path)
+            for file_name in file_names
+        )
+
+    store_hash = hashlib.sha256(os.path.abspath(store_path).encode())
+    for store_file in store_files:
+        file_stat = os.stat(store_file)
+        store_hash.update(
+            "\n{}:{}:{}".format(
+                os.path.relpath(store_file, store_path), file_stat.st_size, file_stat.st_mtime_ns
+            ).encode()
+        )
+    return store_hash.hexdigest()
+
+
+"""
+Function for the result cache key of a run, a hash of the input data, the stores it is read through and the sources they
+record, the active URLs, the arguments that change the results and the program itself
+
+@param args: parsed command line arguments
+"""
+def result_cache_key(args):
+    source = source_fingerprint(args, args.result_cache)
+
+    if args.active_urls_file is not None:
+        active_urls = file_fingerprint(args.active_urls_file, args.result_cache)
+    else:
+        active_urls = gcs_fingerprint(bucket_location_for_active_urls)
+
+    key_inputs = {
+        # The calculator's own source stands in for the program version, so any code change misses the cache
+        "program": file_fingerprint(__file__, args.result_cache),
+        "source": source,
+        "stores": {
+            "parquet_cache": store_fingerprint(args.parquet_cache),
+            "arrow_store": store_fingerprint(args.arrow_store),
+            "rollup_store": store_fingerprint(args.rollup_store),
+            "sources": store_sources(args),
+        },
+        "active_urls": active_urls,
+        "arguments": {
+            "previous_start_date": args.previous_start_date,
+            "current_start_date": args.current_start_date,
+            "time_frame": args.time_frame,
+            "trend": args.trend,
+            "trend_step": args.trend_step,
+            "quantile_sketch": args.quantile_sketch,
+            "bin_edges": sorted(args.bin_edges),
+            "external_metric": args.external_metric,
+        },
+    }
+    return hashlib.sha256(json.dumps(key_inputs, sort_keys=True).encode()).hexdigest()
+
+
+"""
+Helper function for the path of the workbook cached in an entry of the result cache
+
+@param cache_entry: directory of the cache entry
+@param excel_backend: backend the workbook was written with
+"""
+def result_cache_workbook(cache_entry, excel_backend):
+    return os.path.join(cache_entry, "workbook_{}.xlsx".format(excel_backend))
+
+
+"""
+Function for reading the results frames of a cache entry, marking the entry as recently used, None if the entry is missing
+
+@param cache_entry: directory of the cache entry
+"""
+def read_result_cache(cache_entry):
+    results_file = os.path.join(cache_entry, "results.pkl")
+    if not os.path.isfile(results_file):
+        return None
+    os.utime(cache_entry)
+    with open(results_file, "rb") as cached_results:
+        return pickle.load(cached_results)
+
+
+"""
+Function for writing the results frames and optionally the finished workbook to a cache entry,
+each file is written under a temporary name first so a concurrent run never reads a partial entry
+
+@param cache_entry: directory of the cache entry
+@param results: dict of sheet name to results dataframe
+@param workbook_file: optional path of the finished workbook
+@param excel_backend: backend the workbook was written with
+"""
+def write_result_cache(cache_entry, results, workbook_file, excel_backend):
+    os.makedirs(cache_entry, exist_ok=True)
+    results_file = os.path.join(cache_entry, "results.pkl")
+    if not os.path.isfile(results_file):
+        # Pickling keeps mixed columns like outlier_value exactly as they were calculated
+        with open(results_file + ".tmp", "wb") as cached_results:
+            pickle.dump(results, cached_results, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(results_file + ".tmp", results_file)
+
+    cached_workbook = result_cache_workbook(cache_entry, excel_backend)
+    if workbook_file is not None and not os.path.isfile(cached_workbook):
+        shutil.copyfile(workbook_file, cached_workbook + ".tmp")
+        os.replace(cached_workbook + ".tmp", cached_workbook)
+    os.utime(cache_entry)
+
+
+"""
+Function for evicting the least recently used entries of the result cache until it fits in its size cap
+
+@param cache_dir: directory of the result cache
+@param max_bytes: size cap of the result cache
+@param keep_entry: directory of the entry of the current run, which is never evicted
+"""
+def evict_result_cache(cache_dir, max_bytes, keep_entry):
+    cache_entries = []
+    for entry_name in os.listdir(cache_dir):
+        cache_entry = os.path.join(cache_dir, entry_name)
+        if not os.path.isdir(cache_entry):
+            continue
+        entry_bytes = sum(
+            os.path.getsize(os.path.join(cache_entry, file_name))
+            for file_name in os.listdir(cache_entry)
+        )
+        cache_entries.append((os.path.getmtime(cache_entry), cache_entry, entry_bytes))
+
+    cache_bytes = sum(entry_bytes for _, _, entry_bytes in cache_entries)
+    for _, cache_entry, entry_bytes in sorted(cache_entries):
+        if cache_bytes <= max_bytes:
+            break
+        if os.path.samefile(cache_entry, keep_entry):
+            continue
+        shutil.rmtree(cache_entry, ignore_errors=True)
+        cache_bytes -= entry_bytes
+        print("Evicted result cache entry {}".format(os.path.basename(cache_entry)))
+
+
+# Arrow record batch readers of the source table by name, each called with the parsed arguments and timeframes
+source_readers = {
+    "bigquery": read_bigquery_batches,
+    "arrow_file": read_arrow_file_batches,
+}
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,383 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import page_performance_calculator as calculator
+
+# Address the daemon listens on, only local analysts are expected to connect
+default_host = "127.0.0.1"
+default_port = 8765
+
+# Seconds between checks of the source and active URLs files for changes
+default_reload_interval = 300
+
+# Output formats of a report request, json returns the results in the response instead of writing a file
+report_formats = ["xlsx", "streaming", "parquet", "csv", "json"]
+
+# Parameters a report request may set, anything else is rejected rather than silently ignored
+report_request_keys = ["previous_start_date", "current_start_date", "time_frame", "format", "external_metric", "bin_edges"]
+
+
+"""
+Report dataset held in memory, with the source dataset sorted by event_date so the rows of a timeframe are a contiguous slice
+"""
+class ReportDataset:
+    def __init__(self, source_dataset, url_table, active_urls, source_key):
+        # A stable sort keeps the file order within each day, so reports match the command line
+        self.source_dataset = source_dataset.sort_values("event_date", kind="stable")
+        self.event_dates = self.source_dataset["event_date"].to_numpy()
+        self.url_table = url_table
+        self.active_urls = active_urls
+        self.source_key = source_key
+        self.loaded_at = pd.Timestamp.now()
+
+    """
+    Function for the source rows of the timeframes, found by binary search of the sorted event dates
+
+    @param time_frames: dict of timeframe label to (start, end) timestamps
+    """
+    def time_frame_rows(self, time_frames):
+        row_ranges = []
+        for time_frame, (start_date, end_date) in time_frames.items():
+            row_range = np.arange(
+                np.searchsorted(self.event_dates, np.datetime64(start_date), side="left"),
+                np.searchsorted(self.event_dates, np.datetime64(end_date), side="right"),
+            )
+            # An empty timeframe has nothing to compare against, so the request is rejected instead of failing later
+            if len(row_range) == 0:
+                raise ValueError(
+                    "no events in the {} timeframe {} to {}, the loaded dataset covers {} to {}".format(
+                        time_frame,
+                        start_date.strftime("%Y-%m-%d"),
+                        end_date.strftime("%Y-%m-%d"),
+                        pd.Timestamp(self.event_dates[0]).strftime("%Y-%m-%d"),
+                        pd.Timestamp(self.event_dates[-1]).strftime("%Y-%m-%d"),
+                    )
+                )
+            row_ranges.append(row_range)
+        # Overlapping timeframes share rows, calculate_time_frames copies them per timeframe itself
+        return self.source_dataset.take(np.unique(np.concatenate(row_ranges)))
+
+
+"""
+Report daemon loading the source dataset and active URLs once, then serving report requests from memory
+and reloading in the background whenever either file changes
+"""
+class ReportDaemon:
+    def __init__(self, input_file, active_urls_file, output_dir, workers):
+        self.input_file = input_file
+        self.active_urls_file = active_urls_file
+        self.output_dir = output_dir
+        self.workers = workers
+        self.dataset = None
+        # The calculator keeps its stage records in module state, so reports are computed one at a time
+        self.report_lock = threading.Lock()
+
+    """
+    Function for a key that changes whenever the source or active URLs file changes, read from the file metadata only
+    """
+    def source_key(self):
+        import fsspec
+
+        storage_options = {}
+        if self.input_file is None or self.active_urls_file is None:
+            storage_options = {"token": calculator.load_credentials()}
+
+        source_keys = []
+        for path, default_path in [
+            (self.input_file, calculator.bucket_location_for_raw_data),
+            (self.active_urls_file, calculator.bucket_location_for_active_urls),
+        ]:
+            path = path or default_path
+            if path.startswith("gs://"):
+                file_system, file_path = fsspec.core.url_to_fs(path, **storage_options)
+            else:
+                file_system, file_path = fsspec.core.url_to_fs(path)
+            source_keys.append(file_system.ukey(file_path))
+        return tuple(source_keys)
+
+    """
+    Function for loading and indexing the source dataset and active URLs, the same way a command line run loads them
+    """
+    def load_dataset(self):
+        source_key = self.source_key()
+        # Every event_date is kept, reports pick their timeframes from memory
+        load_args = argparse.Namespace(
+            parquet_cache=None,
+            arrow_store=None,
+            refresh_cache=False,
+            source_reader="csv",
+            input_file=self.input_file,
+        )
+        source_dataset = calculator.load_source_dataset(load_args, None)
+
+        if self.active_urls_file is None:
+            print("Getting active URLs file from GCS")
+            active_urls = pd.read_csv(
+                calculator.bucket_location_for_active_urls,
+                encoding="latin-1",
+                storage_options={"token": calculator.load_credentials()},
+            )
+        else:
+            print("Reading active URLs file from path")
+            active_urls = pd.read_csv(self.active_urls_file, encoding="latin-1")
+
+        url_table = calculator.build_url_table(source_dataset, active_urls)
+        return ReportDataset(source_dataset, url_table, active_urls, source_key)
+
+    """
+    Function for checking the files every interval and swapping in a freshly loaded dataset once they change
+
+    @param reload_interval: seconds between checks
+    """
+    def watch_source(self, reload_interval):
+        while True:
+            time.sleep(reload_interval)
+            try:
+                if self.source_key() == self.dataset.source_key:
+                    continue
+                print("Source files changed, reloading the dataset")
+                # Reports keep being served from the previous dataset until the new one is loaded
+                self.dataset = self.load_dataset()
+                print("Dataset reloaded with {} rows".format(len(self.dataset.source_dataset)))
+            except Exception as error:
+                print("Reloading the dataset failed, keeping the loaded one: {}".format(error))
+
+    """
+    Function for calculating and writing a report, returning the response body
+
+    @param report_request: dict of the request parameters
+    """
+    def run_report(self, report_request):
+        if not isinstance(report_request, dict):
+            raise ValueError("the request body needs to be a JSON object")
+        unknown_keys = sorted(set(report_request) - set(report_request_keys))
+        if unknown_keys:
+            raise ValueError(
+                "unsupported parameters {}, a request may set {}".format(
+                    ", ".join(unknown_keys), ", ".join(report_request_keys)
+                )
+            )
+        time_frame = int(report_request.get("time_frame", 13))
+        report_format = report_request.get("format", "xlsx")
+        if report_format not in report_formats:
+            raise ValueError("format needs to be one of {}".format(", ".join(report_formats)))
+        bin_edges = [float(bin_edge) for bin_edge in report_request.get("bin_edges", calculator.external_bin_edges)]
+        if len(bin_edges) < 2:
+            raise ValueError("bin_edges needs at least two bucket edges")
+
+        time_frames = {
+            "previous": calculator.time_frame_bounds(report_request["previous_start_date"], time_frame),
+            "current": calculator.time_frame_bounds(report_request["current_start_date"], time_frame),
+        }
+        report_args = argparse.Namespace(
+            rollup_store=None,
+            quantile_sketch=None,
+            external_metric=report_request.get("external_metric", "plt"),
+            bin_edges=bin_edges,
+            workers=self.workers,
+        )
+        if report_args.external_metric not in ["plt", "srt"]:
+            raise ValueError("external_metric needs to be plt or srt")
+
+        dataset = self.dataset
+        report_start_time = time.perf_counter()
+        source_dataset = dataset.time_frame_rows(time_frames)
+        with self.report_lock:
+            results, _ = calculator.calculate_report_results(
+                report_args,
+                time_frames,
+                dataset.active_urls,
+                loaded_source=(source_dataset, dataset.url_table),
+            )
+
+            response = {
+                "previous_start_date": report_request["previous_start_date"],
+                "current_start_date": report_request["current_start_date"],
+                "time_frame": time_frame,
+                "format": report_format,
+                "dataset_loaded_at": dataset.loaded_at.isoformat(timespec="seconds"),
+            }
+            if report_format == "json":
+                response["results"] = {
+                    sheet_name: json.loads(results_frame.to_json(orient="records"))
+                    for sheet_name, results_frame in results.items()
+                }
+            else:
+                response["output"] = self.write_report(results, report_request, report_format, time_frames)
+            # Stage records would otherwise pile up for as long as the daemon runs
+            calculator.stage_records.clear()
+
+        response["seconds"] = round(time.perf_counter() - report_start_time, 3)
+        return response
+
+    """
+    Function for writing the results of a report with the writers of the command line, returning the output path
+
+    @param results: dict of sheet name to results dataframe
+    @param report_request: dict of the request parameters
+    @param report_format: output format of the report
+    @param time_frames: dict of timeframe label to (start, end) timestamps of the results
+    """
+    def write_report(self, results, report_request, report_format, time_frames):
+        output_name = "page_performance_{}-{}".format(
+            report_request["previous_start_date"], report_request["current_start_date"]
+        )
+        if report_format == "xlsx":
+            output_path = os.path.join(self.output_dir, output_name + ".xlsx")
+            calculator.write_styled_workbook(results, output_path, self.workers)
+        elif report_format == "streaming":
+            output_path = os.path.join(self.output_dir, output_name + ".xlsx")
+            calculator.write_streaming_workbook(results, output_path)
+        else:
+            output_path = os.path.join(self.output_dir, output_name)
+            calculator.write_results_bundle(results, output_path, report_format, time_frames)
+        return os.path.abspath(output_path)
+
+
+"""
+Request handler of the report daemon, GET /status describes the loaded dataset and POST /report runs a report
+"""
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    report_daemon = None
+
+    """
+    Function for describing the loaded dataset
+    """
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_json(404, {"error": "Unknown path {}".format(self.path)})
+            return
+        dataset = self.report_daemon.dataset
+        self.send_json(
+            200,
+            {
+                "rows": len(dataset.source_dataset),
+                "first_event_date": dataset.source_dataset["event_date"].min().strftime("%Y-%m-%d"),
+                "last_event_date": dataset.source_dataset["event_date"].max().strftime("%Y-%m-%d"),
+                "loaded_at": dataset.loaded_at.isoformat(timespec="seconds"),
+            },
+        )
+
+    """
+    Function for running a report from a JSON body with previous_start_date, current_start_date and optionally
+    time_frame, format, external_metric and bin_edges
+    """
+    def do_POST(self):
+        if self.path != "/report":
+            self.send_json(404, {"error": "Unknown path {}".format(self.path)})
+            return
+        try:
+            report_request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            self.send_json(200, self.report_daemon.run_report(report_request))
+        except (KeyError, ValueError, TypeError) as error:
+            self.send_json(400, {"error": "Invalid report request: {}".format(error)})
+        except Exception as error:
+            self.send_json(500, {"error": str(error)})
+
+    """
+    Helper function for sending a JSON response
+
+    @param status: HTTP status code
+    @param body: JSON serializable response body
+    """
+    def send_json(self, status, body):
+        response = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves page performance reports from a source dataset and active URLs held in memory"
+    )
+    parser.add_argument(
+        "-i",
+        "--input_file",
+        metavar="inputfile",
+        type=str,
+        help="Override default file found on GCS with a user specified dataset",
+    )
+    parser.add_argument(
+        "-a",
+        "--active_urls_file",
+        metavar="activeurlfile",
+        type=str,
+        help="Override default file found on GCS with a user specified active URLs dataset",
+    )
+    parser.add_argument(
+        "-od",
+        "--output_dir",
+        metavar="outputdir",
+        type=str,
+        default=".",
+        help="Optionally specify the directory report files are written to. Default is the current directory",
+    )
+    parser.add_argument(
+        "-H",
+        "--host",
+        metavar="host",
+        type=str,
+        default=default_host,
+        help="Optionally specify the address the daemon listens on. Default is 127.0.0.1",
+    )
+    parser.add_argument(
+        "-P",
+        "--port",
+        metavar="port",
+        type=int,
+        default=default_port,
+        help="Optionally specify the port the daemon listens on. Default is 8765",
+    )
+    parser.add_argument(
+        "-ri",
+        "--reload_interval",
+        metavar="seconds",
+        type=float,
+        default=default_reload_interval,
+        help="Optionally specify the seconds between checks of the source files for changes. Default is 300",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        metavar="workers",
+        type=int,
+        default=4,
+        help="Optionally specify the number of threads the results sheets of a report are built and styled on. Default is 4",
+    )
+    args = parser.parse_args()
+
+    if args.reload_interval <= 0:
+        parser.error("--reload_interval needs to be positive")
+    if args.workers < 1:
+        parser.error("--workers needs at least one thread")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    report_daemon = ReportDaemon(args.input_file, args.active_urls_file, args.output_dir, args.workers)
+    report_daemon.dataset = report_daemon.load_dataset()
+    print("Dataset loaded with {} rows".format(len(report_daemon.dataset.source_dataset)))
+
+    threading.Thread(target=report_daemon.watch_source, args=(args.reload_interval,), daemon=True).start()
+
+    ReportRequestHandler.report_daemon = report_daemon
+    server = ThreadingHTTPServer((args.host, args.port), ReportRequestHandler)
+    print("Serving reports on http://{}:{}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Report daemon stopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The calculator and its tools are flat scripts at the repository root rather than an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark_page_performance as benchmark  # noqa: E402
+import page_performance_calculator as calculator  # noqa: E402
+
+
+"""
+Synthetic source file and active URLs file from the benchmark generator, with a fifth of the page load and server response
+times missing
+"""
+@pytest.fixture(scope="session")
+def synthetic_source(tmp_path_factory):
+    source_dir = tmp_path_factory.mktemp("synthetic")
+    source_path, active_urls_path = benchmark.generate_dataset(str(source_dir), 40000, 300, 7)
+
+    source = pd.read_csv(source_path)
+    rng = np.random.default_rng(7)
+    for column in ["page_load_time_ms", "server_response_time_ms"]:
+        source.loc[rng.random(len(source)) < 0.2, column] = np.nan
+    source.to_csv(source_path, index=False)
+    return source_path, active_urls_path
+
+
+"""
+Factory of the parsed command line arguments calculate_report_results reads, for a run over a source file without any store
+"""
+@pytest.fixture
+def report_args():
+    open_files = []
+
+    def build_report_args(source_path, **overrides):
+        input_file = open(source_path, "r")
+        open_files.append(input_file)
+        args = argparse.Namespace(
+            input_file=input_file,
+            source_reader="csv",
+            parquet_cache=None,
+            arrow_store=None,
+            refresh_cache=False,
+            rollup_store=None,
+            quantile_sketch=None,
+            external_metric="plt",
+            bin_edges=calculator.external_bin_edges,
+            workers=1,
+        )
+        for name, value in overrides.items():
+            setattr(args, name, value)
+        return args
+
+    yield build_report_args
+    for input_file in open_files:
+        input_file.close()
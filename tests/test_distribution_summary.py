@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+import page_performance_calculator as calculator
+
+
+"""
+Test that the histogram summary matches the pandas statistics of the same values, the way the baseline calculated them
+"""
+def test_summary_matches_pandas_quantiles():
+    timings = pd.Series([0.4, 1.2, 1.2, 2.5, 3.1, 3.1, 3.1, 7.9, np.nan, 90.0])
+    summary = calculator.summarize_distribution(calculator.value_histogram(timings))
+
+    quartiles = timings.quantile([0, 0.25, 0.5, 0.75, 1]).to_numpy()
+    np.testing.assert_allclose(summary[["Min", "25th", "50th", "75th", "Max"]].to_numpy(), quartiles)
+    assert summary["Total"] == timings.sum()
+    assert summary["Average"] == timings.mean()
+    assert summary["Threshold"] == quartiles[3] + 1.5 * (quartiles[3] - quartiles[1])
+
+
+"""
+Test that a timeframe whose timings are all missing summarizes to NaN statistics instead of failing
+"""
+def test_summary_of_missing_timings_is_nan():
+    timings = pd.Series([np.nan, np.nan, np.nan])
+    summary = calculator.summarize_distribution(calculator.value_histogram(timings))
+
+    assert summary["Total"] == 0
+    for statistic in ["Average", "Min", "25th", "50th", "75th", "Max", "Threshold"]:
+        assert np.isnan(summary[statistic])
+
+
+"""
+Test that a histogram whose counts are all zero gives NaN for every quantile
+"""
+def test_quantiles_of_zero_counts_are_nan():
+    histogram = pd.Series([0, 0], index=[1.0, 2.0])
+    assert np.isnan(calculator.histogram_quantiles(histogram, [0, 0.5, 1])).all()
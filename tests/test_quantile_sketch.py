@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+import page_performance_calculator as calculator
+
+
+"""
+Helper function for the results of a report over the synthetic source
+
+@param args: parsed command line arguments of the run
+@param active_urls_path: path of the active URLs file
+"""
+def report_results(args, active_urls_path):
+    time_frames = {
+        "previous": calculator.time_frame_bounds("20230305", 13),
+        "current": calculator.time_frame_bounds("20230326", 13),
+    }
+    active_urls = pd.read_csv(active_urls_path, encoding="latin-1")
+    results, _ = calculator.calculate_report_results(args, time_frames, active_urls)
+    return results
+
+
+"""
+Helper function for the most buckets a day of sketched timings can fill, from 1 ms to the 90 second clamp plus zero timings
+and the values moved onto the sides of the bin edges
+
+@param relative_accuracy: relative error bound of the sketch
+@param bin_edges: external comparison bin edges in seconds
+"""
+def sketch_bucket_limit(relative_accuracy, bin_edges):
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    return int(np.ceil(np.log(90 / 0.001) / np.log(gamma))) + 2 + 2 * len(bin_edges)
+
+
+"""
+Test that every sketched timing is within the relative accuracy of the timing and that the number of buckets stays under a
+fixed limit as the number of timings grows
+"""
+def test_sketch_buckets_are_bounded_and_accurate():
+    rng = np.random.default_rng(11)
+    bucket_limit = sketch_bucket_limit(0.01, calculator.external_bin_edges)
+    for timing_count in [1000, 100000, 1000000]:
+        timings = pd.Series(np.minimum(rng.lognormal(7.6, 1.5, timing_count).astype("int64"), 90000) / 1000)
+        sketched = calculator.sketch_values(timings, 0.01, calculator.external_bin_edges)
+
+        assert sketched.nunique() <= bucket_limit
+        positive = timings > 0
+        assert (np.abs(sketched[positive] - timings[positive]) <= 0.01 * timings[positive] + 1e-12).all()
+        assert (sketched[~positive] == timings[~positive]).all()
+        np.testing.assert_array_equal(
+            calculator.bin_counts(sketched, calculator.external_bin_edges),
+            calculator.bin_counts(timings, calculator.external_bin_edges),
+        )
+
+
+"""
+Test that a report summarized from the daily sketches of the rollup store is within the reported error bound of the exact
+report, with exact averages, pageview statistics and external comparison, while each day holds a bounded number of buckets
+"""
+def test_sketched_report_is_within_error_bounds(synthetic_source, report_args, tmp_path):
+    source_path, active_urls_path = synthetic_source
+    exact_results = report_results(report_args(source_path), active_urls_path)
+    rollup_store = str(tmp_path / "rollups")
+    sketched_results = report_results(
+        report_args(source_path, rollup_store=rollup_store, quantile_sketch=0.01), active_urls_path
+    )
+
+    exact_top = exact_results["top_level"].set_index("Metrics")
+    sketched_top = sketched_results["top_level"].set_index("Metrics")
+    for column, error_column in [
+        ("Page Load Times (sec)", "Page Load Time Error Bound (sec)"),
+        ("Server Response Times (sec)", "Server Response Time Error Bound (sec)"),
+    ]:
+        errors = (sketched_top[column] - exact_top[column]).abs()
+        assert (errors <= sketched_top[error_column] + 1e-9).all()
+        assert sketched_top[column].iloc[0] == exact_top[column].iloc[0]
+        assert sketched_top[error_column].iloc[0] == 0
+    pd.testing.assert_series_equal(sketched_top["Pages"], exact_top["Pages"])
+    pd.testing.assert_frame_equal(sketched_results["external_comparison"], exact_results["external_comparison"])
+
+    latency_rollups = pd.read_parquet(tmp_path / "rollups" / "latency_daily")
+    day_buckets = latency_rollups.groupby(["event_date", "metric"], observed=True).size()
+    assert day_buckets.max() <= sketch_bucket_limit(0.01, calculator.external_bin_edges)
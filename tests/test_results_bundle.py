@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+import page_performance_calculator as calculator
+
+
+"""
+Test that Parquet bundles keep numeric columns padded with "N/A" placeholders numeric, with nulls for the placeholders, and
+keep text columns as strings
+"""
+def test_parquet_bundle_keeps_numeric_columns(tmp_path):
+    results = {
+        "top_level": pd.DataFrame(
+            {
+                "Metrics": ["Total (Pageviews) / Average (Timing):", "Min:", "Threshold:"],
+                "Pages": [46189.0, 1.0, "N/A"],
+                "Pageview % Change": [0.0033234859675036928, 0.0, "N/A"],
+                "Page Load Times (sec)": [2.97, 0.04, 7.43],
+            }
+        ),
+        "grouped_by_page_url": pd.DataFrame(
+            {
+                "page_url_cleaned": ["/", "/about"],
+                "pv_current": [12, 3],
+                "outlier_value": ["PLT and SRT", "N/A"],
+            }
+        ),
+    }
+    time_frames = {
+        "previous": calculator.time_frame_bounds("20230309", 13),
+        "current": calculator.time_frame_bounds("20230330", 13),
+    }
+    calculator.write_results_bundle(results, str(tmp_path), "parquet", time_frames)
+
+    top_level = pd.read_parquet(tmp_path / "top_level.parquet")
+    assert top_level["Pages"].dtype == np.float64
+    assert top_level["Pageview % Change"].dtype == np.float64
+    assert top_level["Pages"].iloc[0] == 46189
+    assert top_level["Pageview % Change"].iloc[0] == 0.0033234859675036928
+    assert top_level["Pages"].isna().tolist() == [False, False, True]
+
+    grouped_by_page_url = pd.read_parquet(tmp_path / "grouped_by_page_url.parquet")
+    assert grouped_by_page_url["outlier_value"].tolist() == ["PLT and SRT", "N/A"]
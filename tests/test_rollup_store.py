@@ -0,0 +1,65 @@
+import json
+import os
+
+import pandas as pd
+
+import page_performance_calculator as calculator
+
+
+"""
+Helper function for the results of a report over the synthetic source
+
+@param args: parsed command line arguments of the run
+@param active_urls_path: path of the active URLs file
+"""
+def report_results(args, active_urls_path):
+    time_frames = {
+        "previous": calculator.time_frame_bounds("20230305", 13),
+        "current": calculator.time_frame_bounds("20230326", 13),
+    }
+    active_urls = pd.read_csv(active_urls_path, encoding="latin-1")
+    results, _ = calculator.calculate_report_results(args, time_frames, active_urls)
+    return results
+
+
+"""
+Test that a report built from the rollup store matches the one built from the raw events when timings are missing, so every
+average leaves the missing timings out
+"""
+def test_rollup_store_matches_raw_results_with_missing_timings(synthetic_source, report_args, tmp_path):
+    source_path, active_urls_path = synthetic_source
+    raw_results = report_results(report_args(source_path), active_urls_path)
+    rollup_args = report_args(source_path, rollup_store=str(tmp_path / "rollups"))
+    # The first run rolls the days up, the second reads every timeframe back from the store without touching the source
+    for _ in range(2):
+        rollup_results = report_results(rollup_args, active_urls_path)
+
+        assert list(rollup_results) == list(raw_results)
+        for sheet_name, raw_frame in raw_results.items():
+            pd.testing.assert_frame_equal(
+                rollup_results[sheet_name].reset_index(drop=True),
+                raw_frame.reset_index(drop=True),
+                check_dtype=False,
+                check_categorical=False,
+            )
+
+
+"""
+Test that a store written with an older layout is rebuilt rather than read
+"""
+def test_rollup_store_of_older_layout_is_rebuilt(synthetic_source, report_args, tmp_path):
+    source_path, active_urls_path = synthetic_source
+    rollup_args = report_args(source_path, rollup_store=str(tmp_path / "rollups"))
+    report_results(rollup_args, active_urls_path)
+
+    manifest = calculator.read_rollup_manifest(rollup_args.rollup_store)
+    manifest["version"] = calculator.rollup_store_version - 1
+    manifest["days"].append("20991231")
+    with open(os.path.join(rollup_args.rollup_store, "manifest.json"), "w") as manifest_json:
+        json.dump(manifest, manifest_json)
+
+    # Arguments hold the open source file like argparse does, so each run gets its own
+    report_results(report_args(source_path, rollup_store=rollup_args.rollup_store), active_urls_path)
+    manifest = calculator.read_rollup_manifest(rollup_args.rollup_store)
+    assert manifest["version"] == calculator.rollup_store_version
+    assert "20991231" not in manifest["days"]
@@ -0,0 +1,93 @@
+import os
+
+import pandas as pd
+
+import page_performance_calculator as calculator
+
+
+"""
+Helper function for the results of a report over a source file
+
+@param args: parsed command line arguments of the run
+@param active_urls_path: path of the active URLs file
+"""
+def report_results(args, active_urls_path):
+    time_frames = {
+        "previous": calculator.time_frame_bounds("20230305", 13),
+        "current": calculator.time_frame_bounds("20230326", 13),
+    }
+    active_urls = pd.read_csv(active_urls_path, encoding="latin-1")
+    results, _ = calculator.calculate_report_results(args, time_frames, active_urls)
+    return results
+
+
+"""
+Helper function for asserting that two reports have the same results sheets
+
+@param results: dict of sheet name to results dataframe
+@param expected_results: dict of sheet name to results dataframe
+"""
+def assert_same_results(results, expected_results):
+    assert list(results) == list(expected_results)
+    for sheet_name, expected_frame in expected_results.items():
+        pd.testing.assert_frame_equal(
+            results[sheet_name].reset_index(drop=True),
+            expected_frame.reset_index(drop=True),
+            check_dtype=False,
+            check_categorical=False,
+        )
+
+
+"""
+Helper function for writing a copy of the source file with the events up to a day, standing in for a newer export
+
+@param source_path: path of the source file
+@param last_day: last yyyymmdd event_date kept
+@param replaced_path: path the copy is written to, replacing any earlier copy
+"""
+def replace_source(source_path, last_day, replaced_path):
+    source = pd.read_csv(source_path)
+    source[source["event_date"] <= last_day].to_csv(replaced_path, index=False)
+
+
+"""
+Test that a Parquet cache written from an earlier source is rebuilt once the source file is replaced
+"""
+def test_parquet_cache_is_rebuilt_when_source_changes(synthetic_source, report_args, tmp_path):
+    source_path, active_urls_path = synthetic_source
+    replaced_path = str(tmp_path / "source.csv")
+    replace_source(source_path, 20991231, replaced_path)
+    cache_dir = str(tmp_path / "parquet_cache")
+
+    report_results(report_args(replaced_path, parquet_cache=cache_dir), active_urls_path)
+    cached_results = report_results(report_args(replaced_path, parquet_cache=cache_dir), active_urls_path)
+    assert_same_results(cached_results, report_results(report_args(replaced_path), active_urls_path))
+
+    replace_source(source_path, 20230330, replaced_path)
+    replaced_results = report_results(report_args(replaced_path, parquet_cache=cache_dir), active_urls_path)
+    assert_same_results(replaced_results, report_results(report_args(replaced_path), active_urls_path))
+    assert calculator.read_store_manifest(calculator.parquet_cache_manifest_file(cache_dir))["last_day"] == "20230330"
+
+
+"""
+Test that an Arrow store written from an earlier source is rebuilt once the source file is replaced, and that a store without
+a manifest is never trusted
+"""
+def test_arrow_store_is_rebuilt_when_source_changes(synthetic_source, report_args, tmp_path):
+    source_path, active_urls_path = synthetic_source
+    replaced_path = str(tmp_path / "source.csv")
+    replace_source(source_path, 20991231, replaced_path)
+    store_file = str(tmp_path / "source.arrow")
+
+    report_results(report_args(replaced_path, arrow_store=store_file), active_urls_path)
+    mapped_results = report_results(report_args(replaced_path, arrow_store=store_file), active_urls_path)
+    assert_same_results(mapped_results, report_results(report_args(replaced_path), active_urls_path))
+
+    replace_source(source_path, 20230330, replaced_path)
+    replaced_results = report_results(report_args(replaced_path, arrow_store=store_file), active_urls_path)
+    assert_same_results(replaced_results, report_results(report_args(replaced_path), active_urls_path))
+    assert calculator.read_store_manifest(calculator.arrow_store_manifest_file(store_file))["last_day"] == "20230330"
+
+    os.remove(calculator.arrow_store_manifest_file(store_file))
+    report_results(report_args(replaced_path, arrow_store=store_file), active_urls_path)
+    assert os.path.isfile(calculator.arrow_store_manifest_file(store_file))